@@ -7,9 +7,11 @@
 #   https://github.com/facebookresearch/dino/blob/main/vision_transformer.py
 #   https://github.com/rwightman/pytorch-image-models/tree/master/timm/models/vision_transformer.py
 
+from collections import OrderedDict
 from functools import partial
 import math
 import logging
+import threading
 from typing import Sequence, Tuple, Union, Callable
 
 import torch
@@ -22,6 +24,16 @@ from .dinov2_layers import Mlp, PatchEmbed, SwiGLUFFNFused, MemEffAttention, Nes
 
 logger = logging.getLogger("dinov2")
 
+# Dynamo folds is_compiling() to True while tracing; torch.compiler.is_compiling was added in torch 2.3
+try:
+    from torch.compiler import is_compiling as _is_compiling
+except ImportError:
+    try:
+        from torch._dynamo import is_compiling as _is_compiling
+    except ImportError:  # torch < 2.0 has no torch.compile
+        def _is_compiling():
+            return False
+
 
 def named_apply(fn: Callable, module: nn.Module, name="", depth_first=True, include_root=False) -> nn.Module:
     if not depth_first and include_root:
@@ -65,6 +77,7 @@ class DinoVisionTransformer(nn.Module):
         num_register_tokens=0,
         interpolate_antialias=False,
         interpolate_offset=0.1,
+        pos_embed_cache_size=8,
     ):
         """
         Args:
@@ -90,6 +103,7 @@ class DinoVisionTransformer(nn.Module):
             num_register_tokens: (int) number of extra cls tokens (so-called "registers")
             interpolate_antialias: (str) flag to apply anti-aliasing when interpolating positional embeddings
             interpolate_offset: (float) work-around offset to apply when interpolating positional embeddings
+            pos_embed_cache_size: (int) number of interpolated positional embeddings kept for inference, 0 disables the cache
         """
         super().__init__()
         norm_layer = partial(nn.LayerNorm, eps=1e-6)
@@ -103,6 +117,13 @@ class DinoVisionTransformer(nn.Module):
         self.interpolate_antialias = interpolate_antialias
         self.interpolate_offset = interpolate_offset
 
+        # LRU of interpolated positional embeddings keyed by (patch grid h, w, dtype, device)
+        self.pos_embed_cache_size = pos_embed_cache_size
+        self._pos_embed_cache = OrderedDict()
+        self._pos_embed_cache_lock = threading.Lock()
+        self.pos_embed_cache_hits = 0
+        self.pos_embed_cache_misses = 0
+
         self.patch_embed = embed_layer(img_size=img_size, patch_size=patch_size, in_chans=in_chans, embed_dim=embed_dim)
         num_patches = self.patch_embed.num_patches
 
@@ -116,7 +137,8 @@ class DinoVisionTransformer(nn.Module):
         if drop_path_uniform is True:
             dpr = [drop_path_rate] * depth
         else:
-            dpr = [x.item() for x in torch.linspace(0, drop_path_rate, depth)]  # stochastic depth decay rule
+            # explicit cpu device so the module can also be built under a meta device context
+            dpr = [x.item() for x in torch.linspace(0, drop_path_rate, depth, device="cpu")]  # stochastic depth decay rule
 
         if ffn_layer == "mlp":
             logger.info("using MLP layer as FFN")
@@ -176,12 +198,55 @@ class DinoVisionTransformer(nn.Module):
             nn.init.normal_(self.register_tokens, std=1e-6)
         named_apply(init_weights_vit_timm, self)
 
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.clear_pos_embed_cache()
+        super()._load_from_state_dict(*args, **kwargs)
+
+    def clear_pos_embed_cache(self):
+        with self._pos_embed_cache_lock:
+            self._pos_embed_cache.clear()
+
+    def pos_embed_cache_info(self):
+        with self._pos_embed_cache_lock:
+            return {
+                "hits": self.pos_embed_cache_hits,
+                "misses": self.pos_embed_cache_misses,
+                "size": len(self._pos_embed_cache),
+                "max_size": self.pos_embed_cache_size,
+            }
+
     def interpolate_pos_encoding(self, x, w, h):
-        previous_dtype = x.dtype
         npatch = x.shape[1] - 1
         N = self.pos_embed.shape[1] - 1
         if npatch == N and w == h:
             return self.pos_embed
+        # gradients must flow into pos_embed while training, so only inference results are cached;
+        # under torch.compile the lock and cache bookkeeping would break the graph, and the traced
+        # interpolation is already specialised per input shape
+        if self.pos_embed_cache_size <= 0 or torch.is_grad_enabled() or _is_compiling():
+            return self._interpolate_pos_encoding(x, w, h)
+
+        key = (w // self.patch_size, h // self.patch_size, x.dtype, x.device)
+        with self._pos_embed_cache_lock:
+            pos_embed = self._pos_embed_cache.get(key)
+            if pos_embed is not None:
+                self._pos_embed_cache.move_to_end(key)
+                self.pos_embed_cache_hits += 1
+                return pos_embed
+            self.pos_embed_cache_misses += 1
+
+        pos_embed = self._interpolate_pos_encoding(x, w, h)
+
+        with self._pos_embed_cache_lock:
+            self._pos_embed_cache[key] = pos_embed
+            self._pos_embed_cache.move_to_end(key)
+            while len(self._pos_embed_cache) > self.pos_embed_cache_size:
+                self._pos_embed_cache.popitem(last=False)
+        return pos_embed
+
+    def _interpolate_pos_encoding(self, x, w, h):
+        previous_dtype = x.dtype
+        N = self.pos_embed.shape[1] - 1
         pos_embed = self.pos_embed.float()
         class_pos_embed = pos_embed[:, 0]
         patch_pos_embed = pos_embed[:, 1:]
@@ -9,9 +9,11 @@
 #   https://github.com/rwightman/pytorch-image-models/tree/master/timm/models/vision_transformer.py
 
 import logging
+import os
 
 from torch import Tensor
 from torch import nn
+import torch.nn.functional as F
 
 
 logger = logging.getLogger("dinov2")
@@ -26,6 +28,31 @@ except ImportError:
     XFORMERS_AVAILABLE = False
 
 
+SDPA_AVAILABLE = hasattr(F, "scaled_dot_product_attention")
+
+# "sdpa": fused torch.nn.functional.scaled_dot_product_attention (no explicit N x N matrix)
+# "reference": explicit softmax(q @ k^T) @ v
+ATTENTION_BACKENDS = ("sdpa", "reference")
+_attention_backend = os.environ.get("DINOV2_ATTENTION_BACKEND", "sdpa")
+
+if _attention_backend not in ATTENTION_BACKENDS:
+    logger.warning(f"unknown attention backend {_attention_backend}, using sdpa")
+    _attention_backend = "sdpa"
+
+
+def set_attention_backend(backend: str) -> None:
+    global _attention_backend
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(f"attention backend {backend} not in {ATTENTION_BACKENDS}")
+    _attention_backend = backend
+
+
+def get_attention_backend() -> str:
+    if _attention_backend == "sdpa" and not SDPA_AVAILABLE:
+        return "reference"
+    return _attention_backend
+
+
 class Attention(nn.Module):
     def __init__(
         self,
@@ -47,6 +74,25 @@ class Attention(nn.Module):
         self.proj_drop = nn.Dropout(proj_drop)
 
     def forward(self, x: Tensor) -> Tensor:
+        if get_attention_backend() == "sdpa":
+            return self.forward_sdpa(x)
+        return self.forward_reference(x)
+
+    def forward_sdpa(self, x: Tensor) -> Tensor:
+        B, N, C = x.shape
+        qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
+
+        # default SDPA scaling is head_dim**-0.5, identical to self.scale
+        x = F.scaled_dot_product_attention(
+            qkv[0], qkv[1], qkv[2], dropout_p=self.attn_drop.p if self.training else 0.0
+        )
+
+        x = x.transpose(1, 2).reshape(B, N, C)
+        x = self.proj(x)
+        x = self.proj_drop(x)
+        return x
+
+    def forward_reference(self, x: Tensor) -> Tensor:
         B, N, C = x.shape
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
 
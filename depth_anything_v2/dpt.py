@@ -1,12 +1,13 @@
-import cv2
+import time
+
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from torchvision.transforms import Compose
 
 from .dinov2 import DINOv2
 from .util.blocks import FeatureFusionBlock, _make_scratch
-from .util.transform import Resize, NormalizeImage, PrepareForNet
+from .util.transform import FramePreprocessor
 
 
 def _make_fusion_block(features, use_bn, size=None):
@@ -174,6 +175,8 @@ class DepthAnythingV2(nn.Module):
         self.pretrained = DINOv2(model_name=encoder)
         
         self.depth_head = DPTHead(self.pretrained.embed_dim, features, use_bn, out_channels=out_channels, use_clstoken=use_clstoken)
+        
+        self._preprocessors = {}
     
     def forward(self, x):
         patch_h, patch_w = x.shape[-2] // 14, x.shape[-1] // 14
@@ -184,39 +187,129 @@ class DepthAnythingV2(nn.Module):
         
         return depth.squeeze(1)
     
+    def quantize_dynamic_int8(self):
+        """Quantize every nn.Linear in place to dynamic int8 for CPU inference.
+        
+        This covers the qkv/proj/mlp layers of all DINOv2 blocks and, when enabled, the
+        DPT readout projections. The 1x1 convolution projections of the DPT head are not
+        supported by dynamic quantization and stay in fp32.
+        """
+        return torch.ao.quantization.quantize_dynamic(self, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    
     @torch.no_grad()
-    def infer_image(self, raw_image, input_size=518):
-        image, (h, w) = self.image2tensor(raw_image, input_size)
+    def infer_image(self, raw_image, input_size=518, channel_order='BGR'):
+        return self.infer_batch([raw_image], input_size, channel_order)[0]
+    
+    @torch.no_grad()
+    def infer_batch(self, raw_images, input_size=518, channel_order='BGR'):
+        """Estimate depth for several frames with as few forward passes as possible.
+        
+        Frames whose network inputs share a shape are stacked into a single batch.
+        Each depth map is resized back to the resolution of its own input frame and
+        returned in the same order as ``raw_images``.
         
-        depth = self.forward(image)
+        ``channel_order`` is 'BGR' for OpenCV frames or 'RGB' for frames taken straight
+        from PIL, which avoids flipping the channels on the caller's side.
+        """
+        depths = [None] * len(raw_images)
         
-        depth = F.interpolate(depth[:, None], (h, w), mode="bilinear", align_corners=True)[0, 0]
+        for indices, depth in self._forward_groups(raw_images, input_size, channel_order):
+            for idx, frame_depth in zip(indices, depth):
+                h, w = raw_images[idx].shape[:2]
+                frame_depth = F.interpolate(frame_depth[None, None], (h, w), mode="bilinear", align_corners=True)[0, 0]
+                depths[idx] = frame_depth.cpu().numpy()
         
-        return depth.cpu().numpy()
+        return depths
     
-    def image2tensor(self, raw_image, input_size=518):        
-        transform = Compose([
-            Resize(
-                width=input_size,
-                height=input_size,
-                resize_target=False,
-                keep_aspect_ratio=True,
-                ensure_multiple_of=14,
-                resize_method='lower_bound',
-                image_interpolation_method=cv2.INTER_CUBIC,
-            ),
-            NormalizeImage(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-            PrepareForNet(),
-        ])
+    @torch.no_grad()
+    def infer_stats(self, raw_image, threshold, input_size=518, channel_order='BGR'):
+        return self.infer_batch_stats([raw_image], [threshold], input_size, channel_order)[0]
+    
+    @torch.no_grad()
+    def infer_batch_stats(self, raw_images, thresholds, input_size=518, channel_order='BGR'):
+        """Summary statistics of each depth map, computed at network resolution.
         
-        h, w = raw_image.shape[:2]
+        Skips the upsample to the frame size and the full-frame copy to NumPy. For every
+        frame returns the global minimum depth, the minimum over the central region (middle
+        half of rows and columns) and the fraction of pixels closer than its threshold.
+        """
+        stats = [None] * len(raw_images)
         
-        image = cv2.cvtColor(raw_image, cv2.COLOR_BGR2RGB) / 255.0
+        for indices, depth in self._forward_groups(raw_images, input_size, channel_order):
+            h, w = depth.shape[-2:]
+            center_h, center_w = h // 4, w // 4
+            threshold = torch.tensor([thresholds[idx] for idx in indices], dtype=depth.dtype, device=depth.device)
+            
+            min_depth = depth.amin(dim=(1, 2))
+            center_min_depth = depth[:, center_h:3 * center_h, center_w:3 * center_w].amin(dim=(1, 2))
+            below_ratio = (depth < threshold.view(-1, 1, 1)).float().mean(dim=(1, 2))
+            
+            for idx, min_d, center_min_d, ratio in zip(indices, min_depth.tolist(), center_min_depth.tolist(), below_ratio.tolist()):
+                stats[idx] = {'min_depth': min_d, 'center_min_depth': center_min_d, 'below_ratio': ratio}
         
-        image = transform({'image': image})['image']
-        image = torch.from_numpy(image).unsqueeze(0)
+        return stats
+    
+    @torch.no_grad()
+    def warmup(self, frame_shapes, input_sizes, iterations=3, threshold=None):
+        """Run synthetic frames through the inference path for every frame shape and input size.
         
-        DEVICE = 'cuda' if torch.cuda.is_available() else 'mps' if torch.backends.mps.is_available() else 'cpu'
-        image = image.to(DEVICE)
+        The first call at a new shape pays for kernel selection, allocator growth, positional
+        embedding interpolation and, for a compiled model, graph capture. Returns one report
+        per (frame shape, input size) with the latency of that first call ('cold_ms') and the
+        median and worst of the following calls ('warm_ms', 'warm_max_ms'), in milliseconds.
+        With ``threshold`` the ``infer_batch_stats`` path is warmed instead of ``infer_batch``.
+        """
+        reports = []
+        
+        for h, w in frame_shapes:
+            frame = np.full((h, w, 3), 127, dtype=np.uint8)
+            for input_size in input_sizes:
+                timings = []
+                for _ in range(max(2, iterations)):
+                    start = time.perf_counter()
+                    if threshold is None:
+                        self.infer_batch([frame], input_size, channel_order='RGB')
+                    else:
+                        self.infer_batch_stats([frame], [threshold], input_size, channel_order='RGB')
+                    timings.append((time.perf_counter() - start) * 1000)
+                
+                reports.append({
+                    'frame_shape': [h, w],
+                    'input_size': input_size,
+                    'cold_ms': round(timings[0], 1),
+                    'warm_ms': round(float(np.median(timings[1:])), 1),
+                    'warm_max_ms': round(max(timings[1:]), 1),
+                })
+        
+        return reports
+    
+    def _forward_groups(self, raw_images, input_size, channel_order):
+        """Yield (frame indices, network-resolution depth) for each group of same-shaped inputs."""
+        preprocessor = self.get_preprocessor(input_size)
+        
+        groups = {}
+        for idx, raw_image in enumerate(raw_images):
+            groups.setdefault(preprocessor.get_size(*raw_image.shape[:2]), []).append(idx)
+        
+        for indices in groups.values():
+            batch = preprocessor([raw_images[idx] for idx in indices], channel_order)
+            batch = torch.from_numpy(batch).to(self._device())
+            
+            # called through __call__ so a model compiled with nn.Module.compile uses the compiled graph
+            yield indices, self(batch)
+    
+    def image2tensor(self, raw_image, input_size=518, channel_order='BGR'):
+        h, w = raw_image.shape[:2]
+        
+        image = self.get_preprocessor(input_size)([raw_image], channel_order)
+        image = torch.from_numpy(image.copy()).to(self._device())
         
         return image, (h, w)
+    
+    def get_preprocessor(self, input_size=518):
+        if input_size not in self._preprocessors:
+            self._preprocessors[input_size] = FramePreprocessor(input_size)
+        return self._preprocessors[input_size]
+    
+    def _device(self):
+        return next(self.parameters()).device
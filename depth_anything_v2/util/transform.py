@@ -1,3 +1,6 @@
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import cv2
 
@@ -155,4 +158,98 @@ class PrepareForNet(object):
             sample["mask"] = sample["mask"].astype(np.float32)
             sample["mask"] = np.ascontiguousarray(sample["mask"])
         
-        return sample
\ No newline at end of file
+        return sample
+
+
+class FramePreprocessor(object):
+    """Turn uint8 frames into contiguous float32 NCHW network input.
+
+    Produces the same layout as Compose([Resize, NormalizeImage, PrepareForNet])
+    applied to a [0, 1] image, but resizes the uint8 frame directly and folds the
+    1/255 scaling and mean/std normalization into a single multiply-subtract that
+    writes into a reusable per-thread buffer keyed by the output shape.
+
+    Each thread keeps buffers for at most ``max_cached_shapes`` input resolutions,
+    least recently used first out. A buffer is sized for the largest batch seen at
+    its resolution and smaller batches get a ``[:n]`` view of it.
+    """
+
+    max_cached_shapes = 4
+
+    def __init__(
+        self,
+        input_size=518,
+        mean=(0.485, 0.456, 0.406),
+        std=(0.229, 0.224, 0.225),
+        ensure_multiple_of=14,
+        resize_method="lower_bound",
+        image_interpolation_method=cv2.INTER_CUBIC,
+    ):
+        self.input_size = input_size
+        self.__resize = Resize(
+            width=input_size,
+            height=input_size,
+            resize_target=False,
+            keep_aspect_ratio=True,
+            ensure_multiple_of=ensure_multiple_of,
+            resize_method=resize_method,
+            image_interpolation_method=image_interpolation_method,
+        )
+        self.__interpolation = image_interpolation_method
+
+        std = np.asarray(std, dtype=np.float32)
+        self.__scale = (1.0 / (255.0 * std)).reshape(3, 1, 1)
+        self.__offset = (np.asarray(mean, dtype=np.float32) / std).reshape(3, 1, 1)
+
+        self.__local = threading.local()
+
+    def get_size(self, height, width):
+        """Return the network input (height, width) for a frame of the given size."""
+        new_width, new_height = self.__resize.get_size(width, height)
+        return int(new_height), int(new_width)
+
+    def get_buffer(self, batch_size, height, width):
+        buffers = getattr(self.__local, "buffers", None)
+        if buffers is None:
+            buffers = self.__local.buffers = OrderedDict()
+
+        key = (height, width)
+        buffer = buffers.get(key)
+        if buffer is None or len(buffer) < batch_size:
+            buffer = np.empty((batch_size, 3, height, width), dtype=np.float32)
+        buffers[key] = buffer
+        buffers.move_to_end(key)
+        while len(buffers) > self.max_cached_shapes:
+            buffers.popitem(last=False)
+        return buffer[:batch_size]
+
+    def fill(self, out, raw_image, channel_order="BGR"):
+        """Write one HxWx3 frame into a (3, H, W) float32 slot of a batch buffer."""
+        if channel_order not in ("BGR", "RGB"):
+            raise ValueError(f"channel_order {channel_order} not supported")
+
+        height, width = out.shape[-2:]
+        if raw_image.shape[:2] != (height, width):
+            raw_image = cv2.resize(raw_image, (width, height), interpolation=self.__interpolation)
+
+        # HWC -> CHW and BGR -> RGB are both views; the multiply below is the first copy
+        image = raw_image.transpose(2, 0, 1)
+        if channel_order == "BGR":
+            image = image[::-1]
+
+        np.multiply(image, self.__scale, out=out, casting="unsafe")
+        np.subtract(out, self.__offset, out=out)
+        return out
+
+    def __call__(self, raw_images, channel_order="BGR"):
+        """Preprocess frames that share an input resolution into one (N, 3, H, W) array.
+
+        The returned array is a reused buffer, valid until the next call on this thread.
+        """
+        height, width = self.get_size(*raw_images[0].shape[:2])
+        batch = self.get_buffer(len(raw_images), height, width)
+        for slot, raw_image in zip(batch, raw_images):
+            if self.get_size(*raw_image.shape[:2]) != (height, width):
+                raise ValueError("all frames in a batch must map to the same input resolution")
+            self.fill(slot, raw_image, channel_order)
+        return batch
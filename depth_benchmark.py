@@ -0,0 +1,389 @@
+import argparse
+import glob
+import os
+import time
+
+import cv2
+import numpy as np
+
+from depth_anything_v2.util.transform import Resize, NormalizeImage, PrepareForNet, FramePreprocessor
+
+
+# Portrait phone frames as (height, width)
+PHONE_FRAMES = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+
+MODEL_CONFIGS = {
+    'vits': {'encoder': 'vits', 'features': 64, 'out_channels': [48, 96, 192, 384]},
+    'vitb': {'encoder': 'vitb', 'features': 128, 'out_channels': [96, 192, 384, 768]},
+    'vitl': {'encoder': 'vitl', 'features': 256, 'out_channels': [256, 512, 1024, 1024]},
+}
+
+
+def load_frames(frames_dir, limit=None):
+    paths = sorted(
+        path for pattern in ('*.jpg', '*.jpeg', '*.png')
+        for path in glob.glob(os.path.join(frames_dir, pattern))
+    )
+    frames = [(os.path.basename(path), cv2.imread(path)) for path in paths[:limit]]
+    return [(name, frame) for name, frame in frames if frame is not None]
+
+
+def load_depth_model(args, device='cpu'):
+    import torch
+    from depth_anything_v2.dpt import DepthAnythingV2
+
+    model = DepthAnythingV2(**{**MODEL_CONFIGS[args.encoder], 'max_depth': args.max_depth})
+    model.load_state_dict(torch.load(args.checkpoint, map_location='cpu'))
+    return model.to(device).eval()
+
+
+def synthetic_frame(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    # smooth noise so the cubic resize sees image-like content rather than pure noise
+    small = rng.integers(0, 256, size=(height // 16, width // 16, 3), dtype=np.uint8)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def time_call(fn, repeat, warmup=2):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    return float(np.median(timings)), float(np.percentile(timings, 95))
+
+
+def legacy_preprocess(raw_image, input_size=518):
+    """image2tensor as it was before FramePreprocessor, minus the torch conversion."""
+    transforms = [
+        Resize(
+            width=input_size,
+            height=input_size,
+            resize_target=False,
+            keep_aspect_ratio=True,
+            ensure_multiple_of=14,
+            resize_method='lower_bound',
+            image_interpolation_method=cv2.INTER_CUBIC,
+        ),
+        NormalizeImage(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+        PrepareForNet(),
+    ]
+    sample = {'image': cv2.cvtColor(raw_image, cv2.COLOR_BGR2RGB) / 255.0}
+    for transform in transforms:
+        sample = transform(sample)
+    return sample['image'][None]
+
+
+def bench_preprocess(args):
+    preprocessor = FramePreprocessor(args.input_size)
+
+    print(f"input_size={args.input_size}, repeat={args.repeat}")
+    print(f"{'frame':>8} {'legacy p50':>11} {'legacy p95':>11} {'new p50':>9} {'new p95':>9} {'speedup':>8} {'max |diff|':>11}")
+    for label, (height, width) in PHONE_FRAMES.items():
+        frame = synthetic_frame(height, width)
+
+        legacy_p50, legacy_p95 = time_call(lambda: legacy_preprocess(frame, args.input_size), args.repeat)
+        new_p50, new_p95 = time_call(lambda: preprocessor([frame]), args.repeat)
+
+        diff = np.abs(legacy_preprocess(frame, args.input_size) - preprocessor([frame])).max()
+        print(f"{label:>8} {legacy_p50:>9.2f}ms {legacy_p95:>9.2f}ms {new_p50:>7.2f}ms {new_p95:>7.2f}ms "
+              f"{legacy_p50 / new_p50:>7.2f}x {diff:>11.4f}")
+
+
+def peak_memory_mb(fn, device):
+    """CUDA: peak allocated memory. CPU: largest single-op allocation seen by the profiler."""
+    import torch
+
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        fn()
+        torch.cuda.synchronize()
+        return (torch.cuda.max_memory_allocated() - base) / 2**20
+
+    from torch.profiler import profile, ProfilerActivity
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn()
+    return max((event.cpu_memory_usage for event in prof.key_averages()), default=0) / 2**20
+
+
+def bench_attention(args):
+    import torch
+    from depth_anything_v2.dinov2 import DINOv2
+    from depth_anything_v2.dinov2_layers.attention import Attention, set_attention_backend
+
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+
+    encoder = DINOv2(args.encoder).to(device).eval()
+    block_attn = encoder.blocks[0].attn
+    attn = Attention(encoder.embed_dim, num_heads=block_attn.num_heads, qkv_bias=True).to(device).eval()
+    attn.load_state_dict(block_attn.state_dict())
+
+    patch_h, patch_w = args.height // 14, args.width // 14
+    tokens = torch.randn(args.batch, patch_h * patch_w + 1, encoder.embed_dim, device=device)
+    image = torch.randn(args.batch, 3, patch_h * 14, patch_w * 14, device=device)
+
+    def run_layer():
+        with torch.no_grad():
+            return attn(tokens)
+
+    def run_encoder():
+        with torch.no_grad():
+            return encoder.get_intermediate_layers(image, 4)
+
+    def sync(fn):
+        def wrapped():
+            out = fn()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            return out
+        return wrapped
+
+    results = {}
+    for backend in ('reference', 'sdpa'):
+        set_attention_backend(backend)
+        results[backend] = {
+            'layer': run_layer(),
+            'encoder': run_encoder(),
+            'layer_ms': time_call(sync(run_layer), args.repeat),
+            'encoder_ms': time_call(sync(run_encoder), max(1, args.repeat // 10)),
+            'layer_mb': peak_memory_mb(run_layer, device),
+        }
+
+    layer_diff = (results['reference']['layer'] - results['sdpa']['layer']).abs().max().item()
+    encoder_diff = max(
+        (ref - sdpa).abs().max().item()
+        for ref, sdpa in zip(results['reference']['encoder'], results['sdpa']['encoder'])
+    )
+
+    print(f"encoder={args.encoder}, input={patch_h * 14}x{patch_w * 14}, tokens={tokens.shape[1]}, "
+          f"batch={args.batch}, device={device}")
+    print(f"{'backend':>10} {'attn p50':>9} {'attn p95':>9} {'encoder p50':>12} {'attn peak':>10}")
+    for backend, result in results.items():
+        print(f"{backend:>10} {result['layer_ms'][0]:>7.2f}ms {result['layer_ms'][1]:>7.2f}ms "
+              f"{result['encoder_ms'][0]:>10.1f}ms {result['layer_mb']:>8.1f}MB")
+    print(f"parity: attention max |diff|={layer_diff:.2e}, encoder max |diff|={encoder_diff:.2e}")
+
+    if max(layer_diff, encoder_diff) > args.tolerance:
+        raise SystemExit(f"sdpa and reference attention differ by more than {args.tolerance}")
+
+
+def depth_errors(reference, estimate):
+    valid = reference > 1e-3
+    reference, estimate = reference[valid], estimate[valid]
+    ratio = np.maximum(reference / estimate, estimate / reference)
+    return {
+        'abs_rel': float(np.mean(np.abs(estimate - reference) / reference)),
+        'rmse': float(np.sqrt(np.mean((estimate - reference) ** 2))),
+        'delta1': float(np.mean(ratio < 1.25)),
+    }
+
+
+def bench_quantize(args):
+    import torch
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    frames = load_frames(args.frames, args.limit)
+    if not frames:
+        raise SystemExit(f"no frames found in {args.frames}")
+
+    fp32_model = load_depth_model(args)
+    int8_model = load_depth_model(args).quantize_dynamic_int8()
+
+    rows = []
+    for name, frame in frames:
+        fp32_ms = time_call(lambda: fp32_model.infer_image(frame, args.input_size), args.repeat, warmup=1)[0]
+        int8_ms = time_call(lambda: int8_model.infer_image(frame, args.input_size), args.repeat, warmup=1)[0]
+        errors = depth_errors(fp32_model.infer_image(frame, args.input_size), int8_model.infer_image(frame, args.input_size))
+        rows.append({'name': name, 'fp32_ms': fp32_ms, 'int8_ms': int8_ms, **errors})
+
+    print(f"encoder={args.encoder}, input_size={args.input_size}, frames={len(rows)}, threads={torch.get_num_threads()}")
+    print(f"{'frame':>24} {'fp32':>9} {'int8':>9} {'abs_rel':>8} {'rmse(m)':>8} {'delta1':>7}")
+    for row in rows:
+        print(f"{row['name'][-24:]:>24} {row['fp32_ms']:>7.1f}ms {row['int8_ms']:>7.1f}ms "
+              f"{row['abs_rel']:>8.4f} {row['rmse']:>8.4f} {row['delta1']:>7.4f}")
+    mean = {key: float(np.mean([row[key] for row in rows])) for key in ('fp32_ms', 'int8_ms', 'abs_rel', 'rmse', 'delta1')}
+    print(f"{'mean':>24} {mean['fp32_ms']:>7.1f}ms {mean['int8_ms']:>7.1f}ms "
+          f"{mean['abs_rel']:>8.4f} {mean['rmse']:>8.4f} {mean['delta1']:>7.4f}")
+    print(f"speedup: {mean['fp32_ms'] / mean['int8_ms']:.2f}x")
+
+
+def bench_resolution(args):
+    import torch
+    from obstacle_detection import summarize_depth
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    frames = load_frames(args.frames, args.limit)
+    if not frames:
+        raise SystemExit(f"no frames found in {args.frames}")
+
+    model = load_depth_model(args, args.device)
+    reference_size = max(args.sizes)
+
+    stats = {size: [] for size in args.sizes}
+    latency = {size: [] for size in args.sizes}
+    for _, frame in frames:
+        rgb = np.ascontiguousarray(frame[:, :, ::-1])
+        for size in args.sizes:
+            latency[size].append(time_call(lambda: model.infer_image(rgb, size, channel_order='RGB'), args.repeat, warmup=1)[0])
+            stats[size].append(summarize_depth(model.infer_image(rgb, size, channel_order='RGB'), args.calibration_factor))
+
+    print(f"encoder={args.encoder}, frames={len(frames)}, reference={reference_size}, "
+          f"calibration_factor={args.calibration_factor}, device={args.device}")
+    print(f"{'size':>6} {'p50':>9} {'speedup':>8} {'warn agree':>11} {'warn rate':>10} {'|dmin| (m)':>11}")
+    reference = stats[reference_size]
+    for size in sorted(args.sizes):
+        agreement = np.mean([ours['should_warn'] == ref['should_warn'] for ours, ref in zip(stats[size], reference)])
+        warn_rate = np.mean([ours['should_warn'] for ours in stats[size]])
+        min_diff = np.mean([abs(ours['min_distance'] - ref['min_distance']) for ours, ref in zip(stats[size], reference)])
+        p50 = float(np.median(latency[size]))
+        speedup = float(np.median(latency[reference_size])) / p50
+        print(f"{size:>6} {p50:>7.1f}ms {speedup:>7.2f}x {agreement:>10.1%} {warn_rate:>9.1%} {min_diff:>11.3f}")
+
+
+def bench_warmup(args):
+    import torch
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = load_depth_model(args, args.device)
+    if args.compile:
+        model.compile(dynamic=False)
+    shapes = [tuple(int(v) for v in reversed(shape.split('x'))) for shape in args.frame_shapes]
+    threshold = 0.5 if args.stats else None
+
+    # the first pass is what a request sees on a cold server; the second pass starts from
+    # the state the server's boot warm-up leaves behind, so its first call should already be warm
+    cold = model.warmup(shapes, args.sizes, args.repeat, threshold)
+    warm = model.warmup(shapes, args.sizes, args.repeat, threshold)
+
+    print(f"encoder={args.encoder}, device={args.device}, compile={args.compile}, "
+          f"path={'infer_batch_stats' if args.stats else 'infer_batch'}, threads={torch.get_num_threads()}")
+    print(f"{'frame (WxH)':>12} {'size':>5} {'cold 1st':>10} {'warm 1st':>10} {'steady p50':>11} {'steady max':>11}")
+    for before, after in zip(cold, warm):
+        h, w = before['frame_shape']
+        print(f"{f'{w}x{h}':>12} {before['input_size']:>5} {before['cold_ms']:>8.1f}ms {after['cold_ms']:>8.1f}ms "
+              f"{after['warm_ms']:>9.1f}ms {after['warm_max_ms']:>9.1f}ms")
+
+
+def bench_load(args):
+    import requests
+    from concurrent.futures import ThreadPoolExecutor
+
+    frames = load_frames(args.frames, args.limit)
+    if not frames:
+        raise SystemExit(f"no frames found in {args.frames}")
+    payloads = [cv2.imencode('.jpg', frame)[1].tobytes() for _, frame in frames]
+    url = args.url.rstrip('/') + '/analyze_depth'
+
+    def client(client_idx):
+        session = requests.Session()
+        timings, statuses = [], []
+        deadline = time.perf_counter() + args.duration
+        request_idx = 0
+        while time.perf_counter() < deadline:
+            payload = payloads[(client_idx + request_idx) % len(payloads)]
+            start = time.perf_counter()
+            response = session.post(url, files={'image': ('frame.jpg', payload, 'image/jpeg')},
+                                    data={'clientId': f'load-{client_idx}', 'inputSize': args.input_size})
+            timings.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+            request_idx += 1
+        return timings, statuses
+
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        results = list(executor.map(client, range(args.clients)))
+
+    timings = np.array([t for result in results for t, status in zip(*result) if status == 200]) * 1000
+    statuses = [status for _, result_statuses in results for status in result_statuses]
+    rejected = sum(status == 503 for status in statuses)
+    print(f"url={url}, clients={args.clients}, duration={args.duration}s, input_size={args.input_size}")
+    print(f"requests={len(statuses)}, ok={len(timings)}, busy(503)={rejected}, other={len(statuses) - len(timings) - rejected}")
+    if len(timings):
+        print(f"throughput={len(timings) / args.duration:.1f} req/s, p50={np.median(timings):.1f}ms, "
+              f"p95={np.percentile(timings, 95):.1f}ms, p99={np.percentile(timings, 99):.1f}ms")
+
+
+def add_model_arguments(parser):
+    parser.add_argument('--checkpoint', default=os.path.join('checkpoints', 'depth_anything_v2_metric_hypersim_vits.pth'))
+    parser.add_argument('--encoder', default='vits', choices=list(MODEL_CONFIGS))
+    parser.add_argument('--max-depth', type=float, default=20.0)
+    parser.add_argument('--frames', default=os.path.join('ablation_study', 'test_file'))
+    parser.add_argument('--limit', type=int, default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Depth Anything V2 serving benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    preprocess = subparsers.add_parser('preprocess', help='legacy Compose preprocessing vs FramePreprocessor')
+    preprocess.add_argument('--input-size', type=int, default=518)
+    preprocess.add_argument('--repeat', type=int, default=50)
+    preprocess.set_defaults(func=bench_preprocess)
+
+    attention = subparsers.add_parser('attention', help='SDPA vs reference attention: parity, latency, memory')
+    attention.add_argument('--encoder', default='vits', choices=['vits', 'vitb', 'vitl', 'vitg'])
+    attention.add_argument('--height', type=int, default=518)
+    attention.add_argument('--width', type=int, default=518)
+    attention.add_argument('--batch', type=int, default=1)
+    attention.add_argument('--device', default='cpu')
+    attention.add_argument('--repeat', type=int, default=20)
+    attention.add_argument('--tolerance', type=float, default=1e-4)
+    attention.set_defaults(func=bench_attention)
+
+    quantize = subparsers.add_parser('quantize', help='dynamic int8 vs fp32 accuracy and CPU latency report')
+    add_model_arguments(quantize)
+    quantize.add_argument('--input-size', type=int, default=518)
+    quantize.add_argument('--repeat', type=int, default=3)
+    quantize.add_argument('--threads', type=int, default=None)
+    quantize.set_defaults(func=bench_quantize)
+
+    resolution = subparsers.add_parser('resolution', help='latency and obstacle-decision agreement per input size')
+    add_model_arguments(resolution)
+    resolution.add_argument('--sizes', type=int, nargs='+', default=[252, 364, 518])
+    resolution.add_argument('--calibration-factor', type=float, default=1.0)
+    resolution.add_argument('--device', default='cpu')
+    resolution.add_argument('--repeat', type=int, default=3)
+    resolution.add_argument('--threads', type=int, default=None)
+    resolution.set_defaults(func=bench_resolution)
+
+    warmup = subparsers.add_parser('warmup', help='first-request latency before and after boot warm-up')
+    add_model_arguments(warmup)
+    warmup.add_argument('--frame-shapes', nargs='+', default=['720x1280'], help='frame sizes as WIDTHxHEIGHT')
+    warmup.add_argument('--sizes', type=int, nargs='+', default=[518])
+    warmup.add_argument('--stats', action='store_true', help='warm the network-resolution stats path')
+    warmup.add_argument('--compile', action='store_true', help='torch.compile the model first (PyTorch 2.2+)')
+    warmup.add_argument('--device', default='cpu')
+    warmup.add_argument('--repeat', type=int, default=5)
+    warmup.add_argument('--threads', type=int, default=None)
+    warmup.set_defaults(func=bench_warmup)
+
+    load = subparsers.add_parser('load', help='throughput and tail latency of a running server under concurrent clients')
+    load.add_argument('--url', default='http://localhost:8081')
+    load.add_argument('--frames', default=os.path.join('ablation_study', 'test_file'))
+    load.add_argument('--limit', type=int, default=None)
+    load.add_argument('--clients', type=int, default=4)
+    load.add_argument('--duration', type=float, default=30.0)
+    load.add_argument('--input-size', type=int, default=518)
+    load.set_defaults(func=bench_load)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
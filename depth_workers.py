@@ -0,0 +1,515 @@
+import atexit
+import itertools
+import logging
+import multiprocessing as mp
+import queue
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import connection, shared_memory
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class DepthQueueFull(RuntimeError):
+    """깊이 추론 큐가 가득 차서 프레임을 받을 수 없을 때 발생합니다."""
+
+
+class DepthTimeout(RuntimeError):
+    """깊이 추론 결과가 제한 시간 안에 오지 않았을 때 발생합니다."""
+
+
+def load_depth_checkpoint(config, checkpoint_path, max_depth, device, quantize=None, compile=False):
+    """
+    DepthAnythingV2를 mmap 체크포인트로 만들고 옵션에 따라 int8 양자화, torch.compile을 적용합니다.
+    mmap으로 연결된 fp32 가중치는 페이지 캐시에서 오므로 같은 파일을 연 모든 프로세스가 공유합니다.
+    """
+    from depth_anything_v2.dpt import DepthAnythingV2
+    from depth_anything_v2.registry import load_checkpoint_model
+
+    model = load_checkpoint_model(
+        lambda: DepthAnythingV2(**config, max_depth=max_depth),
+        checkpoint_path,
+        device
+    ).eval()
+    if quantize == 'int8':
+        if device == 'cpu':
+            model.quantize_dynamic_int8()
+        else:
+            logger.warning("DEPTH_QUANTIZE=int8 is only supported on CPU; running fp32 on GPU")
+    if compile:
+        # nn.Module.compile는 torch 2.2 이상에서만 제공
+        if hasattr(model, 'compile'):
+            model.compile(dynamic=False)
+        else:
+            logger.warning("DEPTH_COMPILE=1 requires PyTorch 2.2+; running eagerly")
+    return model
+
+
+def run_depth_jobs(get_model, jobs):
+    """
+    (frame, model_name, input_size, threshold) 작업들을 모델·해상도·결과 종류별로 묶어 추론합니다.
+    threshold가 없으면 원본 크기 깊이 맵, 있으면 네트워크 해상도 통계를 계산하며
+    작업 순서대로 (결과, 예외) 쌍의 리스트를 반환합니다.
+    """
+    outcomes = [None] * len(jobs)
+
+    groups = {}
+    for idx, (_, model_name, input_size, threshold) in enumerate(jobs):
+        groups.setdefault((model_name, input_size, threshold is None), []).append(idx)
+
+    for (model_name, input_size, wants_depth_map), indices in groups.items():
+        frames = [jobs[idx][0] for idx in indices]
+        try:
+            depth_model = get_model(model_name)
+            if depth_model is None:
+                raise RuntimeError(f"깊이 모델 '{model_name}'을 로드할 수 없습니다")
+            if wants_depth_map:
+                results = depth_model.infer_batch(frames, input_size, channel_order='RGB')
+            else:
+                thresholds = [jobs[idx][3] for idx in indices]
+                results = depth_model.infer_batch_stats(frames, thresholds, input_size, channel_order='RGB')
+        except Exception as e:
+            for idx in indices:
+                outcomes[idx] = (None, e)
+            continue
+
+        for idx, result in zip(indices, results):
+            outcomes[idx] = (result, None)
+
+    return outcomes
+
+
+def _collect_batch(tasks, first, max_batch_size, max_wait):
+    """첫 작업 도착 후 max_wait 동안 추가 작업을 모읍니다. 종료 신호(None)를 받으면 두 번째 값이 True."""
+    batch = [first]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            task = tasks.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if task is None:
+            return batch, True
+        batch.append(task)
+    return batch, False
+
+
+def _worker_main(worker_idx, specs, options, max_pixels, tasks, results):
+    """워커 프로세스: 모델을 로드하고 공유 메모리 슬롯의 프레임을 배치로 추론합니다."""
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - depth-worker-{worker_idx} - %(levelname)s - %(message)s')
+
+    import torch
+    from depth_anything_v2.registry import ModelRegistry
+
+    torch.set_num_threads(options['threads'])
+    slots = {}  # 슬롯 이름 -> SharedMemory (부모가 슬롯을 필요할 때 만들므로 처음 볼 때 연결)
+
+    def slot_buffer(slot_name):
+        if slot_name not in slots:
+            slots[slot_name] = shared_memory.SharedMemory(name=slot_name)
+        return slots[slot_name].buf
+
+    def load(model_name):
+        spec = specs[model_name]
+        return load_depth_checkpoint(spec['config'], spec['checkpoint_path'], spec['max_depth'],
+                                     options['device'], options['quantize'], options['compile'])
+
+    registry = ModelRegistry(load, options['memory_budget_bytes'])
+    try:
+        # 요청에 쓰일 모델은 모두 여기서 로드 (배치 루프 안에서 체크포인트를 읽지 않도록)
+        for model_name in options['preload_models']:
+            registry.get(model_name)
+        model = registry.get(options['default_model'])
+        warmup = [model.warmup(*args) for args in options['warmup']] if options['warmup'] else None
+    except Exception as e:
+        logger.error(f"깊이 워커 초기화 실패: {e}", exc_info=True)
+        results.send(('failed', worker_idx, repr(e)))
+        return
+    results.send(('ready', worker_idx, warmup))
+
+    stop = False
+    while not stop:
+        first = tasks.get()
+        if first is None:
+            break
+        batch, stop = _collect_batch(tasks, first, options['max_batch_size'], options['max_wait'])
+        results.send(('batch', worker_idx, len(batch)))
+
+        jobs = []
+        for job_id, slot_name, shape, inline_frame, model_name, input_size, threshold in batch:
+            frame = inline_frame if inline_frame is not None else np.ndarray(shape, np.uint8, buffer=slot_buffer(slot_name))
+            jobs.append((frame, model_name, input_size, threshold))
+
+        for task, (result, error) in zip(batch, run_depth_jobs(registry.get, jobs)):
+            job_id, slot_name, shape, inline_frame, _, _, threshold = task
+            if error is not None:
+                results.send(('error', job_id, repr(error)))
+            elif threshold is None and inline_frame is None:
+                # 원본 크기 깊이 맵은 입력 프레임 뒤쪽 영역에 써서 반환
+                out = np.ndarray(result.shape, np.float32, buffer=slot_buffer(slot_name), offset=max_pixels * 3)
+                out[...] = result
+                results.send(('done', job_id, ('slot', result.shape)))
+            else:
+                results.send(('done', job_id, ('value', result)))
+
+
+def _start_without_main(process):
+    """
+    spawn 자식이 부모의 __main__ 스크립트(python server.py)를 __mp_main__으로 다시 실행하지 않도록
+    __main__의 파일·모듈 정보를 잠시 숨기고 프로세스를 시작합니다.
+    워커 진입점은 이 모듈에 있으므로 자식은 depth_workers만 import합니다.
+    """
+    main_module = sys.modules['__main__']
+    saved = {name: main_module.__dict__[name] for name in ('__file__', '__spec__') if name in main_module.__dict__}
+    main_module.__dict__.pop('__file__', None)
+    main_module.__spec__ = None
+    try:
+        process.start()
+    finally:
+        main_module.__dict__.update(saved)
+
+
+class DepthProcessPool:
+    """
+    깊이 추론을 N개의 워커 프로세스에서 실행하는 풀 (DepthBatcher와 같은 submit/infer 인터페이스).
+
+    각 워커는 체크포인트를 mmap으로 로드해 fp32 가중치를 페이지 캐시에서 공유하고,
+    GIL 없이 각자 torch intra-op 스레드를 사용합니다. 워커마다 작업 큐와 결과 파이프를 따로 두고
+    부모가 작업을 배정할 때 담당 워커를 기록하므로, 워커가 죽어도 다른 워커가 멈추지 않고
+    처리 중이던 요청만 실패 처리됩니다.
+
+    프레임은 피클링 없이 공유 메모리 슬롯으로 전달됩니다. 슬롯은 필요할 때 만들고
+    /dev/shm 여유 공간의 절반까지만 사용하며, 슬롯이 없거나 슬롯보다 큰 프레임은 작업 큐로 직접 전달합니다.
+    Docker 기본 /dev/shm(64 MiB)에서는 1920x1080 슬롯(약 14 MiB)을 몇 개밖에 만들 수 없으므로
+    --shm-size로 늘리거나 DEPTH_PROCESS_MAX_FRAME을 줄이세요.
+    """
+
+    SHM_USAGE_FRACTION = 0.5
+    MAX_RESTART_DELAY_S = 30.0
+
+    def __init__(self, specs, num_workers, max_batch_size, max_wait_ms, max_queue_size, max_frame_pixels,
+                 job_timeout_s=10.0, max_restarts=5):
+        self.specs = specs
+        self.num_workers = max(1, num_workers)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_queued = max(self.num_workers, max_queue_size)
+        self.max_pixels = max_frame_pixels
+        self.slot_size = self.max_pixels * (3 + 4)  # uint8 RGB 입력 + float32 깊이 맵 출력
+        self.job_timeout_s = job_timeout_s
+        self.max_restarts = max_restarts
+        self.failed = None  # 모든 워커가 재시작 한도를 넘으면 원인 메시지
+
+        self._ctx = mp.get_context('spawn')
+        self._slots = []
+        self._free_slots = []
+        self._max_slots = 0
+        self._workers = {}  # worker_idx -> process, tasks, results, jobs, ready, failures, restart_at, error
+        self._options = None
+        self._job_ids = itertools.count()
+        self._pending = {}  # job_id -> (future, slot_idx, worker_idx, submitted_at)
+        self._lock = threading.Lock()
+        self._ready_changed = threading.Condition(self._lock)
+        self._closing = False
+        self.stats = {"batches": 0, "frames": 0, "largest_batch": 0, "rejected": 0, "inline_frames": 0,
+                      "restarts": 0, "timeouts": 0, "hung_workers": 0}
+
+    def start(self, options, timeout=600):
+        """
+        워커 프로세스를 만들고 모든 워커의 모델 로드를 기다립니다. 실패하면 띄운 워커를 정리하고 예외를 냅니다.
+        options: device, threads, quantize, compile, default_model, preload_models, memory_budget_bytes, warmup
+        워커별 워밍업 리포트를 반환합니다.
+        """
+        self._options = dict(options, max_batch_size=self.max_batch_size, max_wait=self.max_wait)
+        self._max_slots = self._shm_slot_limit()
+        atexit.register(self.shutdown)
+
+        for worker_idx in range(self.num_workers):
+            self._workers[worker_idx] = {"jobs": set(), "failures": 0, "restart_at": None, "error": None}
+            self._spawn(worker_idx)
+        threading.Thread(target=self._collector, daemon=True).start()
+
+        deadline = time.monotonic() + timeout
+        with self._ready_changed:
+            while True:
+                workers = list(self._workers.values())
+                failed = [worker["error"] for worker in workers if worker["error"]]
+                if failed or all(worker["ready"] for worker in workers):
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    failed = [f"{timeout}초 안에 준비되지 않음"]
+                    break
+                self._ready_changed.wait(timeout=min(remaining, 1.0))
+                # 초기화 중 죽은 워커 (예: 메모리 부족으로 강제 종료)
+                for worker_idx, worker in self._workers.items():
+                    if not worker["ready"] and not worker["error"] and not worker["process"].is_alive():
+                        worker["error"] = f"exit code {worker['process'].exitcode}"
+        if failed:
+            self.shutdown()
+            raise RuntimeError(f"깊이 워커 초기화 실패: {failed[0]}")
+
+        threading.Thread(target=self._monitor, daemon=True).start()
+        logger.info(f"깊이 워커 프로세스 {self.num_workers}개 준비 완료 "
+                    f"(대기 한도 {self.max_queued}프레임, 공유 메모리 슬롯 최대 {self._max_slots}개 × {self.slot_size / 2**20:.1f} MiB)")
+        return [self._workers[worker_idx]["warmup"] for worker_idx in sorted(self._workers)]
+
+    def submit(self, frame, input_size, threshold=None, model_name=None):
+        inline_frame = None
+        with self._lock:
+            if len(self._pending) >= self.max_queued:
+                self.stats["rejected"] += 1
+                raise DepthQueueFull(f"깊이 추론 큐가 가득 찼습니다 ({self.max_queued}프레임)")
+            ready = [idx for idx, worker in self._workers.items() if worker["ready"]]
+            if not ready:
+                self.stats["rejected"] += 1
+                raise DepthQueueFull("사용 가능한 깊이 워커가 없습니다 (재시작 중)")
+
+            # 처리 중인 작업이 가장 적은 워커에 배정
+            worker_idx = min(ready, key=lambda idx: len(self._workers[idx]["jobs"]))
+            worker = self._workers[worker_idx]
+            slot_idx = self._acquire_slot() if frame.shape[0] * frame.shape[1] <= self.max_pixels else None
+            if slot_idx is None:
+                inline_frame = np.ascontiguousarray(frame)
+                self.stats["inline_frames"] += 1
+
+            future = Future()
+            job_id = next(self._job_ids)
+            self._pending[job_id] = (future, slot_idx, worker_idx, time.monotonic())
+            worker["jobs"].add(job_id)
+            tasks = worker["tasks"]
+
+        slot_name = None
+        if slot_idx is not None:
+            slot = self._slots[slot_idx]
+            np.ndarray(frame.shape, np.uint8, buffer=slot.buf)[...] = frame
+            slot_name = slot.name
+        try:
+            tasks.put((job_id, slot_name, frame.shape, inline_frame, model_name or self._options['default_model'], input_size, threshold))
+        except ValueError:
+            pass  # 그 사이 워커가 종료되어 큐가 닫힘 - 이 작업은 _handle_exit가 이미 실패 처리함
+        return future
+
+    def wait(self, future):
+        """결과를 job_timeout_s까지 기다립니다. 시간을 넘기면 DepthTimeout (슬롯은 워커가 끝내거나 정리될 때 반납)."""
+        try:
+            return future.result(timeout=self.job_timeout_s)
+        except FutureTimeoutError:
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise DepthTimeout(f"깊이 추론이 {self.job_timeout_s:.0f}초 안에 끝나지 않았습니다")
+
+    def infer(self, frame, input_size, model_name=None):
+        return self.wait(self.submit(frame, input_size, model_name=model_name))
+
+    def infer_stats(self, frame, threshold, input_size, model_name=None):
+        return self.wait(self.submit(frame, input_size, threshold, model_name))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["queued"] = len(self._pending)
+            stats["workers"] = sum(worker["ready"] for worker in self._workers.values())
+            stats["shm_slots"] = len(self._slots)
+        stats["queue_capacity"] = self.max_queued
+        stats["max_shm_slots"] = self._max_slots
+        stats["avg_batch"] = round(stats["frames"] / stats["batches"], 2) if stats["batches"] else 0
+        stats["failed"] = self.failed
+        return stats
+
+    def shutdown(self):
+        if self._closing:
+            return
+        self._closing = True
+        workers = list(self._workers.values())
+        for worker in workers:
+            if worker.get("process") is not None and worker["process"].is_alive() and worker.get("tasks") is not None:
+                worker["tasks"].put(None)
+        for worker in workers:
+            process = worker.get("process")
+            if process is None:
+                continue
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=1)
+            self._abandon_tasks(worker)
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []
+
+    def _shm_slot_limit(self):
+        """/dev/shm 여유 공간으로 만들 수 있는 슬롯 수 (여유 공간보다 큰 공유 메모리에 쓰면 SIGBUS)."""
+        try:
+            free = shutil.disk_usage('/dev/shm').free
+        except OSError:
+            return self.max_queued
+        limit = min(self.max_queued, int(free * self.SHM_USAGE_FRACTION) // self.slot_size)
+        if limit < self.max_queued:
+            logger.warning(f"/dev/shm 여유 공간 {free / 2**20:.0f} MiB로 공유 메모리 슬롯을 {limit}개까지만 사용합니다 "
+                           f"(나머지 프레임은 작업 큐로 전달, Docker는 --shm-size로 늘릴 수 있음)")
+        return limit
+
+    def _acquire_slot(self):
+        """빈 슬롯 번호를 반환합니다. 없으면 한도 안에서 새로 만들고, 한도에 닿았으면 None (_lock 안에서 호출)."""
+        if self._free_slots:
+            return self._free_slots.pop()
+        if len(self._slots) >= self._max_slots:
+            return None
+        self._slots.append(shared_memory.SharedMemory(create=True, size=self.slot_size))
+        return len(self._slots) - 1
+
+    @staticmethod
+    def _abandon_tasks(worker):
+        """
+        더 쓰지 않는 작업 큐를 닫습니다 (_lock 안에서 호출 가능).
+        읽을 프로세스가 없는 큐에 큰 인라인 프레임이 남아 있으면 피더 스레드가 영원히 막히고
+        종료 시 그 스레드를 join하느라 인터프리터가 멈추므로, join을 취소하고 남은 데이터는 버림.
+        """
+        tasks = worker.get("tasks")
+        if tasks is None:
+            return
+        worker["tasks"] = None
+        tasks.cancel_join_thread()
+        tasks.close()
+
+    def _spawn(self, worker_idx):
+        # 죽은 워커가 큐 잠금을 쥔 채 남았을 수 있으므로 작업 큐와 결과 파이프는 매번 새로 만듦
+        tasks = self._ctx.Queue()
+        results_reader, results_writer = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_idx, self.specs, self._options, self.max_pixels, tasks, results_writer),
+            name=f"depth-worker-{worker_idx}",
+            daemon=True
+        )
+        _start_without_main(process)
+        results_writer.close()
+        with self._lock:
+            self._workers[worker_idx].update(process=process, tasks=tasks, results=results_reader,
+                                             ready=False, restart_at=None, warmup=None)
+
+    def _collector(self):
+        while not self._closing:
+            with self._lock:
+                readers = {worker["results"]: idx for idx, worker in self._workers.items() if worker.get("results") is not None}
+            for reader in connection.wait(list(readers), timeout=1.0):
+                try:
+                    message = reader.recv()
+                except Exception:
+                    # 워커 종료 또는 전송 도중 강제 종료된 메시지 (정리는 _monitor가 담당)
+                    with self._lock:
+                        worker = self._workers[readers[reader]]
+                        if worker["results"] is reader:
+                            worker["results"] = None
+                    reader.close()
+                    continue
+                self._handle_message(readers[reader], *message)
+
+    def _handle_message(self, worker_idx, kind, key, payload):
+        if kind == 'batch':
+            with self._lock:
+                self.stats["batches"] += 1
+                self.stats["frames"] += payload
+                self.stats["largest_batch"] = max(self.stats["largest_batch"], payload)
+            return
+        if kind in ('ready', 'failed'):
+            with self._ready_changed:
+                worker = self._workers[worker_idx]
+                if kind == 'ready':
+                    worker.update(ready=True, failures=0, warmup=payload)
+                else:
+                    worker["error"] = payload
+                self._ready_changed.notify_all()
+            log = logger.info if kind == 'ready' else logger.error
+            log(f"깊이 워커 {worker_idx} 초기화: {kind}" + ("" if kind == 'ready' else f" ({payload})"))
+            return
+
+        with self._lock:
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                return
+            future, slot_idx, owner, _ = entry
+            self._workers[owner]["jobs"].discard(key)
+
+        if kind == 'error':
+            future.set_exception(RuntimeError(payload))
+        else:
+            where, value = payload
+            if where == 'slot':
+                value = np.ndarray(value, np.float32, buffer=self._slots[slot_idx].buf, offset=self.max_pixels * 3).copy()
+            future.set_result(value)
+        self._release_slot(slot_idx)
+
+    def _release_slot(self, slot_idx):
+        if slot_idx is not None:
+            with self._lock:
+                self._free_slots.append(slot_idx)
+
+    def _monitor(self):
+        """
+        죽은 워커가 처리 중이던 요청을 실패 처리하고 지수 백오프로 다시 띄웁니다.
+        연속 max_restarts번 초기화에 실패한 워커는 더 띄우지 않으며, 모든 워커가 그렇게 되면 failed를 기록합니다.
+        작업이 job_timeout_s의 두 배를 넘도록 끝나지 않는 워커는 멈춘 것으로 보고 종료시킵니다.
+        """
+        while not self._closing:
+            time.sleep(1.0)
+            now = time.monotonic()
+            for worker_idx, worker in list(self._workers.items()):
+                process = worker["process"]
+                if process is None:
+                    if worker["restart_at"] is not None and now >= worker["restart_at"]:
+                        logger.info(f"깊이 워커 {worker_idx} 재시작 (연속 실패 {worker['failures']}회)")
+                        self._spawn(worker_idx)
+                    continue
+                if process.is_alive():
+                    with self._lock:
+                        started = [self._pending[job_id][3] for job_id in worker["jobs"] if job_id in self._pending]
+                    if started and now - min(started) > self.job_timeout_s * 2:
+                        logger.error(f"깊이 워커 {worker_idx}가 {now - min(started):.0f}초 동안 응답하지 않아 종료합니다")
+                        with self._lock:
+                            self.stats["hung_workers"] += 1
+                        process.terminate()
+                    continue
+                self._handle_exit(worker_idx, process, now)
+
+    def _handle_exit(self, worker_idx, process, now):
+        with self._lock:
+            worker = self._workers[worker_idx]
+            lost = [self._pending.pop(job_id) for job_id in worker["jobs"] if job_id in self._pending]
+            worker["jobs"] = set()
+            worker["failures"] += 1
+            worker.update(process=None, ready=False, error=None)
+            self._abandon_tasks(worker)
+            self.stats["restarts"] += 1
+            if worker["failures"] > self.max_restarts:
+                worker["restart_at"] = None
+                delay = None
+            else:
+                delay = min(self.MAX_RESTART_DELAY_S, 2.0 ** (worker["failures"] - 1))
+                worker["restart_at"] = now + delay
+            gave_up = all(other["process"] is None and other["restart_at"] is None for other in self._workers.values())
+
+        for future, slot_idx, _, _ in lost:
+            future.set_exception(RuntimeError(f"깊이 워커 {worker_idx}가 비정상 종료되었습니다"))
+            self._release_slot(slot_idx)
+
+        if delay is None:
+            logger.error(f"깊이 워커 {worker_idx} 종료됨 (exit code {process.exitcode}), "
+                         f"연속 {self.max_restarts}회 재시작 실패로 더 이상 재시작하지 않음")
+        else:
+            logger.error(f"깊이 워커 {worker_idx} 종료됨 (exit code {process.exitcode}), "
+                         f"처리 중이던 요청 {len(lost)}개 실패 처리 후 {delay:.0f}초 뒤 재시작")
+        if gave_up:
+            self.failed = f"모든 깊이 워커가 재시작 한도({self.max_restarts}회)를 넘었습니다"
+            logger.error(f"❌ {self.failed}")
@@ -0,0 +1,145 @@
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+logger = logging.getLogger(__name__)
+
+
+def model_nbytes(model):
+    """Resident bytes of a module's parameters and buffers, including packed quantized weights."""
+    seen, total = set(), 0
+
+    def visit(value):
+        nonlocal total
+        if isinstance(value, (tuple, list)):
+            for item in value:
+                visit(item)
+        elif torch.is_tensor(value):
+            key = (value.device, value.data_ptr())
+            if key not in seen:
+                seen.add(key)
+                total += value.numel() * value.element_size()
+
+    for value in model.state_dict(keep_vars=True).values():
+        visit(value)
+    return total
+
+
+def load_checkpoint_model(build_model, checkpoint_path, device):
+    """Build a model and load its checkpoint without random init or a second weight copy.
+
+    ``build_model()`` is called on the meta device, so no weights are allocated or
+    initialized, and the memory-mapped checkpoint tensors are assigned to the module
+    directly. Mapped pages come from the page cache and are shared by every process that
+    loads the same file. Older torch versions and legacy (non-zip) checkpoints fall back
+    to a regular read.
+    """
+    try:
+        state_dict = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+        mmapped = True
+    except (TypeError, RuntimeError, pickle.UnpicklingError) as e:
+        logger.warning(f"cannot memory-map {checkpoint_path} ({e}), reading it into memory")
+        state_dict = torch.load(checkpoint_path, map_location="cpu")
+        mmapped = False
+
+    try:
+        with torch.device("meta"):
+            model = build_model()
+        model.load_state_dict(state_dict, assign=True)
+    except (AttributeError, TypeError, NotImplementedError) as e:
+        # torch < 2.1: no meta device context or load_state_dict(assign=...)
+        logger.warning(f"meta-device construction unavailable ({e}), initializing weights normally")
+        model = build_model()
+        model.load_state_dict(state_dict)
+
+    logger.info(f"loaded {checkpoint_path} ({'mmap' if mmapped else 'read'})")
+    return model.to(device)
+
+
+class ModelRegistry(object):
+    """Load models by name on first use and keep their total size under a memory budget.
+
+    ``loader(name)`` builds a ready-to-use model. When the resident models exceed
+    ``memory_budget_bytes``, the least recently used ones are dropped; callers that still
+    hold a reference keep working and the memory is released once they let go.
+    A budget of ``None`` or 0 means no limit.
+    """
+
+    def __init__(self, loader, memory_budget_bytes=None):
+        self._loader = loader
+        self.memory_budget_bytes = memory_budget_bytes or None
+
+        self._models = OrderedDict()  # name -> (model, nbytes), least recently used first
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def get(self, name):
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                self.stats["hits"] += 1
+                return self._models[name][0]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # one load per name at a time; other names keep being served meanwhile
+        with load_lock:
+            with self._lock:
+                if name in self._models:
+                    self._models.move_to_end(name)
+                    self.stats["hits"] += 1
+                    return self._models[name][0]
+
+            model = self._loader(name)
+            nbytes = model_nbytes(model)
+
+            with self._lock:
+                self._models[name] = (model, nbytes)
+                self.stats["loads"] += 1
+                self._evict_over_budget(keep=name)
+            logger.info(f"loaded model '{name}' ({nbytes / 2**20:.1f} MiB, resident {self.resident_bytes() / 2**20:.1f} MiB)")
+            return model
+
+    def peek(self, name):
+        """Return a resident model without loading it or touching its recency."""
+        with self._lock:
+            entry = self._models.get(name)
+            return entry[0] if entry else None
+
+    def evict(self, name):
+        with self._lock:
+            return self._models.pop(name, None) is not None
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(nbytes for _, nbytes in self._models.values())
+
+    def info(self):
+        with self._lock:
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_bytes": sum(nbytes for _, nbytes in self._models.values()),
+                "models": [{"name": name, "bytes": nbytes} for name, (_, nbytes) in self._models.items()],
+                **self.stats,
+            }
+
+    def _evict_over_budget(self, keep):
+        if not self.memory_budget_bytes:
+            return
+        total = sum(nbytes for _, nbytes in self._models.values())
+        for name in list(self._models):
+            if total <= self.memory_budget_bytes:
+                break
+            if name == keep:
+                continue
+            _, nbytes = self._models.pop(name)
+            total -= nbytes
+            self.stats["evictions"] += 1
+            logger.info(f"evicted model '{name}' ({nbytes / 2**20:.1f} MiB) to stay under the memory budget")
+        if total > self.memory_budget_bytes:
+            logger.warning(f"model '{keep}' alone exceeds the memory budget ({total / 2**20:.1f} MiB)")
@@ -10,6 +10,7 @@ import cv2
 import os
 
 from depth_anything_v2.dpt import DepthAnythingV2
+from depth_anything_v2.registry import ModelRegistry, load_checkpoint_model
 
 logging.basicConfig(
     level=logging.INFO,
@@ -21,13 +22,16 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-MODEL_CACHE = {}
+# 상주 모델 메모리 예산 (MB, 0이면 제한 없음). 초과 시 가장 오래 사용하지 않은 모델부터 해제
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))
 
 MODEL_CONFIGS = {
     'vits': {'encoder': 'vits', 'features': 64, 'out_channels': [48, 96, 192, 384]},
     'vitb': {'encoder': 'vitb', 'features': 128, 'out_channels': [96, 192, 384, 768]},
     'vitl': {'encoder': 'vitl', 'features': 256, 'out_channels': [256, 512, 1024, 1024]},
 }
+# 요청에서 받을 수 있는 모델 이름 (metric_{dataset}_{encoder}), 레지스트리에는 이 이름만 전달
+MODEL_NAMES = sorted(f'metric_{dataset}_{encoder}' for dataset in ('hypersim', 'vkitti') for encoder in MODEL_CONFIGS)
 
 def get_font(size=20):
     """결과 표시에 사용할 폰트를 가져옵니다."""
@@ -38,46 +42,46 @@ def get_font(size=20):
 
 def load_model(model_name='metric_hypersim_vits'):
     """
-    사용자가 선택한 Depth Anything V2 Metric Depth 모델을 동적으로 로드합니다.
+    사용자가 선택한 Depth Anything V2 Metric Depth 모델을 레지스트리에서 가져옵니다 (처음 사용 시 로드).
     model_name 형식: metric_{dataset}_{encoder} 예: metric_hypersim_vits
     """
-    if model_name in MODEL_CACHE:
-        logger.info(f"캐시에서 '{model_name}' 모델을 사용합니다.")
-        return MODEL_CACHE[model_name]
-
-    logger.info(f"'{model_name}' 모델 로딩을 시작합니다...")
     try:
-        parts = model_name.split('_')
-        dataset = parts[1]  # 'hypersim' or 'vkitti'
-        encoder = parts[2]  # 'vits', 'vitb', 'vitl'
-        
-        # 데이터셋에 따라 max_depth 설정
-        max_depth = 20 if dataset == 'hypersim' else 80
-        
-        # 모델 아키텍처 생성
-        model = DepthAnythingV2(**{**MODEL_CONFIGS[encoder], 'max_depth': max_depth})
-        
-        # 로컬 체크포인트 경로 설정 (단순화)
-        checkpoint_filename = f'depth_anything_v2_{model_name}.pth'
-        checkpoint_path = os.path.join('checkpoints', checkpoint_filename)
-        logger.info(f"로컬 체크포인트에서 가중치를 로드합니다: {checkpoint_path}")
-        
-        if not os.path.exists(checkpoint_path):
-            raise FileNotFoundError(f"체크포인트 파일을 찾을 수 없습니다: {checkpoint_path}")
-            
-        state_dict = torch.load(checkpoint_path, map_location="cpu")
-        model.load_state_dict(state_dict)
-        
-        model.to(DEVICE)
-        model.eval()
-        
-        MODEL_CACHE[model_name] = model
-        logger.info(f"✅ '{model_name}' (max_depth: {max_depth}m) 모델 로딩 및 GPU 이동 완료!")
-        return model
+        return MODEL_REGISTRY.get(model_name)
     except Exception as e:
         logger.error(f"❌ 모델 로딩 중 심각한 오류 발생: {e}", exc_info=True)
         return None
 
+def _build_model(model_name):
+    """model_name(metric_{dataset}_{encoder})에 해당하는 체크포인트로 모델을 생성합니다."""
+    logger.info(f"'{model_name}' 모델 로딩을 시작합니다...")
+    parts = model_name.split('_')
+    dataset = parts[1]  # 'hypersim' or 'vkitti'
+    encoder = parts[2]  # 'vits', 'vitb', 'vitl'
+    
+    # 데이터셋에 따라 max_depth 설정
+    max_depth = 20 if dataset == 'hypersim' else 80
+    
+    # 로컬 체크포인트 경로 설정 (단순화)
+    checkpoint_filename = f'depth_anything_v2_{model_name}.pth'
+    checkpoint_path = os.path.join('checkpoints', checkpoint_filename)
+    logger.info(f"로컬 체크포인트에서 가중치를 로드합니다: {checkpoint_path}")
+    
+    if not os.path.exists(checkpoint_path):
+        raise FileNotFoundError(f"체크포인트 파일을 찾을 수 없습니다: {checkpoint_path}")
+        
+    # 모델 아키텍처를 랜덤 초기화 없이 생성하고 mmap 체크포인트 가중치를 바로 연결
+    model = load_checkpoint_model(
+        lambda: DepthAnythingV2(**{**MODEL_CONFIGS[encoder], 'max_depth': max_depth}),
+        checkpoint_path,
+        DEVICE
+    )
+    model.eval()
+    
+    logger.info(f"✅ '{model_name}' (max_depth: {max_depth}m) 모델 로딩 및 GPU 이동 완료!")
+    return model
+
+MODEL_REGISTRY = ModelRegistry(_build_model, int(MODEL_MEMORY_BUDGET_MB * 2**20))
+
 def analyze_true_metric_depth(depth_map_meters):
     """
     실제 미터 단위 깊이 맵을 9개 구역으로 나누어 분석합니다.
@@ -180,6 +184,8 @@ def analyze():
         data = request.get_json()
         image_data = base64.b64decode(data['image'])
         model_name = data.get('model', 'metric_hypersim_vits') 
+        if model_name not in MODEL_NAMES:
+            return jsonify({"error": f"model은 {MODEL_NAMES} 중 하나여야 합니다."}), 400
         calibration_factor = float(data.get('calibrationFactor', 1.0)) # 보정 계수
         
         pil_image = Image.open(io.BytesIO(image_data)).convert("RGB")
@@ -242,6 +248,8 @@ def calibrate():
         height_cm = float(data['height'])
         image_data = base64.b64decode(data['image'])
         model_name = data.get('model', 'metric_hypersim_vits')
+        if model_name not in MODEL_NAMES:
+            return jsonify({"error": f"model은 {MODEL_NAMES} 중 하나여야 합니다."}), 400
 
         # 1. 예상 팔 길이 계산 (키의 40%)
         estimated_arm_length_m = (height_cm * 0.4) / 100
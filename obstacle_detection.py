@@ -0,0 +1,65 @@
+import numpy as np
+
+
+OBSTACLE_THRESHOLD_M = 0.5  # 50cm
+OBSTACLE_RATIO_LIMIT = 0.1  # 전체 화면의 10%
+
+
+def center_region(image):
+    """깊이 맵 또는 HxWxC 프레임의 중앙 1/4 영역 (가로·세로 각각 가운데 절반) 뷰를 반환합니다."""
+    h, w = image.shape[:2]
+    center_h, center_w = h // 4, w // 4
+    return image[center_h:3*center_h, center_w:3*center_w]
+
+
+def corridor_input_size(input_size):
+    """
+    중앙 통로만 잘라 추론할 때의 해상도.
+    잘라낸 영역은 가로·세로가 절반이므로 절반 해상도로도 전체 프레임 추론과 같은 픽셀 밀도를 유지합니다.
+    """
+    return max(14, int(round(input_size / 2 / 14)) * 14)
+
+
+def compose_corridor_depth(periphery_depth, corridor_depth):
+    """저해상도 전체 깊이 맵의 중앙 영역을 고해상도 중앙 통로 깊이 맵으로 덮어씁니다."""
+    depth_map = np.array(periphery_depth, copy=True)
+    center_region(depth_map)[...] = corridor_depth
+    return depth_map
+
+
+def summarize_depth(depth_map, calibration_factor=1.0):
+    """
+    깊이 맵에서 /analyze_depth 응답에 필요한 장애물 통계를 계산합니다.
+    경고 조건: 중앙 영역에 50cm 이내 물체가 있거나, 전체 화면의 10% 이상이 장애물인 경우
+    """
+    # 보정 계수 적용
+    depth_map_calibrated = depth_map * calibration_factor
+
+    # 장애물이 있는 픽셀의 비율 계산
+    close_obstacles = depth_map_calibrated < OBSTACLE_THRESHOLD_M
+    obstacle_ratio = float(np.sum(close_obstacles)) / depth_map_calibrated.size
+
+    # 중앙 영역에서 가장 가까운 거리 확인
+    min_distance = float(np.min(center_region(depth_map_calibrated)))
+
+    return {
+        "should_warn": min_distance < OBSTACLE_THRESHOLD_M or obstacle_ratio > OBSTACLE_RATIO_LIMIT,
+        "min_distance": min_distance,
+        "global_min_distance": float(np.min(depth_map_calibrated)),
+        "obstacle_ratio": obstacle_ratio,
+    }
+
+
+def summarize_depth_stats(raw_stats, calibration_factor=1.0):
+    """
+    DepthAnythingV2.infer_stats 결과(네트워크 해상도 통계)로 summarize_depth와 같은 필드를 계산합니다.
+    보정 계수는 선형이므로 임계값을 미리 나눠서 전달합니다 (obstacle_threshold / calibration_factor).
+    """
+    min_distance = raw_stats["center_min_depth"] * calibration_factor
+    obstacle_ratio = raw_stats["below_ratio"]
+    return {
+        "should_warn": min_distance < OBSTACLE_THRESHOLD_M or obstacle_ratio > OBSTACLE_RATIO_LIMIT,
+        "min_distance": min_distance,
+        "global_min_distance": raw_stats["min_depth"] * calibration_factor,
+        "obstacle_ratio": obstacle_ratio,
+    }
@@ -1,22 +1,29 @@
 import os
 import time
+import json
 import logging
 import requests
-import google.generativeai as genai
 from flask import Flask, render_template, request, jsonify, Response, stream_with_context, session
 from flask_cors import CORS
 from PIL import Image
 import io
 from dotenv import load_dotenv
 import math
+import itertools
+import re
 import uuid
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 import numpy as np
-import torch
 from werkzeug.utils import secure_filename
 from PIL import Image, ImageDraw, ImageFont
-from depth_anything_v2.dpt import DepthAnythingV2
+from depth_workers import DepthQueueFull, DepthTimeout, DepthProcessPool, load_depth_checkpoint, run_depth_jobs
+from obstacle_detection import (
+    OBSTACLE_THRESHOLD_M, summarize_depth, summarize_depth_stats,
+    center_region, corridor_input_size, compose_corridor_depth
+)
 import sys
 
 
@@ -36,15 +43,349 @@ app = Flask(__name__)
 
 # --- 글로벌 상태 관리 ---
 navigation_sessions = {}
-latest_response = None  # 최신 응답 하나만 저장 (파이프라이닝)
-response_lock = threading.Lock()  # 최신 응답 보호
-tts_status = {"is_speaking": False, "current_text": ""}
-current_image = None
-image_lock = threading.Lock()
-auto_processing = {"enabled": False, "thread": None}
-stop_event = threading.Event()  # 스레드 중지 신호등
-api_rotation = {"current_idx": 0}  # API 순환을 위한 인덱스
-pending_requests = {}  # 대기 중인 요청들 추적
+
+# --- 응답 스트림 (Server-Sent Events) ---
+# 새 응답이 게시될 때마다 /stream_responses 구독자에게 바로 전달 (이미지는 /upload_image로 따로 전송)
+SSE_SUBSCRIBER_QUEUE_SIZE = 8
+SSE_KEEPALIVE_S = 15.0
+
+class ResponseBroadcaster:
+    """구독자마다 작은 큐를 두고 이벤트를 전달합니다. 큐가 가득 찬 느린 구독자는 가장 오래된 이벤트부터 버립니다."""
+    
+    def __init__(self, max_queue_size):
+        self.max_queue_size = max_queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.stats = {"published": 0, "dropped": 0}
+    
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+    
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.stats["published"] += 1
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait((event, data))
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                        with self._lock:
+                            self.stats["dropped"] += 1
+                    except queue.Empty:
+                        pass
+    
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "subscribers": len(self._subscribers)}
+
+# --- 클라이언트별 파이프라인 세션 ---
+# 프레임, 최신 응답, TTS 상태, 요청 추적, 자동 처리 워커를 클라이언트마다 따로 두어 동시 사용자 간 간섭을 막음
+# 세션 키는 X-Client-Id 헤더 또는 clientId 값, 없으면 접속 IP
+# PIPELINE_SESSION_IDLE_S 동안 요청이 없고 스트림 구독자도 없는 세션은 워커를 멈추고 제거
+PIPELINE_SESSION_IDLE_S = float(os.getenv("PIPELINE_SESSION_IDLE_S", "300"))
+# 동시 세션 한도 (도달하면 유휴 세션만 정리하고, 없으면 새 클라이언트를 503으로 거절)
+PIPELINE_MAX_SESSIONS = int(os.getenv("PIPELINE_MAX_SESSIONS", "64"))
+
+class FrameMailbox:
+    """
+    최신 프레임 한 장만 담는 우편함. 업로드된 인코딩 바이트를 그대로 보관하고 버전 번호를 붙입니다.
+    bytes는 불변이라 워커와 Gemini 호출에 복사 없이 넘길 수 있습니다.
+    """
+    def __init__(self):
+        self._frame = None  # {"version", "data", "mime_type", "size", "received_at"}
+        self._version = 0
+        self._changed = threading.Condition()
+        self.stats = {"posted": 0, "taken": 0, "replaced_unsent": 0}
+    
+    def put(self, data, mime_type, size=None):
+        """새 프레임을 게시하고 버전 번호를 반환합니다. 아직 가져가지 않은 이전 프레임은 덮어씁니다."""
+        with self._changed:
+            if self._frame is not None and not self._frame["taken"]:
+                self._frame["replaced"] = True
+                self.stats["replaced_unsent"] += 1
+            self._version += 1
+            self._frame = {
+                "version": self._version,
+                "data": data,
+                "mime_type": mime_type,
+                "size": size,
+                "received_at": time.time(),
+                "taken": False,
+                "replaced": False
+            }
+            self.stats["posted"] += 1
+            self._changed.notify_all()
+            return self._version
+    
+    def wait_newer(self, version, timeout):
+        """
+        version보다 새 프레임이 올라올 때까지 최대 timeout초 대기합니다. 없으면 None.
+        키 슬롯이 없어 보내지 못할 수도 있으므로 가져간 것으로 표시하지 않습니다 (전송 후 mark_sent).
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._frame is not None and self._frame["version"] > version, timeout=timeout)
+            frame = self._frame
+            if frame is None or frame["version"] <= version:
+                return None
+            return frame
+    
+    def mark_sent(self, frame):
+        """wait_newer로 받은 프레임을 Gemini에 보냈다고 기록합니다."""
+        with self._changed:
+            if frame["taken"]:
+                return
+            frame["taken"] = True
+            self.stats["taken"] += 1
+            if frame["replaced"]:
+                # 키 슬롯을 기다리는 사이 새 프레임으로 덮였지만 결국 보낸 프레임
+                self.stats["replaced_unsent"] -= 1
+    
+    def clear(self):
+        with self._changed:
+            self._frame = None
+            self._changed.notify_all()  # 대기 중인 워커가 중지 신호를 바로 확인하도록 깨움
+    
+    def get_stats(self):
+        with self._changed:
+            frame = self._frame
+            return {
+                "version": self._version,
+                "has_frame": frame is not None,
+                "frame_bytes": len(frame["data"]) if frame else 0,
+                **self.stats
+            }
+
+# Gemini에 업로드 바이트 그대로 보내는 형식 (그 밖의 형식은 한 번 디코딩해 JPEG로 다시 인코딩)
+GEMINI_INLINE_IMAGE_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+# HEIC/HEIF는 PIL 플러그인 없이 열 수 없으므로 ISO BMFF ftyp 브랜드로 판별
+HEIF_BRANDS = {b"heic": "image/heic", b"heix": "image/heic", b"mif1": "image/heif", b"msf1": "image/heif"}
+
+def is_complete_image(data, image_format):
+    """형식별 끝 표식으로 잘린 업로드를 걸러냅니다 (픽셀 디코딩 없음)."""
+    if image_format == "JPEG":
+        return data.rstrip(b"\x00").endswith(b"\xff\xd9")  # EOI 마커 (일부 인코더는 0으로 패딩)
+    if image_format == "PNG":
+        return data.endswith(b"IEND\xaeB`\x82")  # IEND 청크와 CRC
+    if image_format == "WEBP":
+        return len(data) >= 8 + int.from_bytes(data[4:8], "little")  # RIFF 헤더의 전체 길이
+    return True
+
+def prepare_frame_bytes(data):
+    """
+    업로드 바이트를 Gemini에 보낼 (bytes, mime_type, 해상도)로 만듭니다.
+    JPEG/PNG/WEBP/HEIC는 헤더와 끝 표식만 확인해 그대로 쓰고, 그 밖에 PIL이 읽을 수 있는 형식은 JPEG로 변환합니다.
+    형식을 알 수 없거나 잘린 이미지는 ValueError.
+    """
+    if data[4:8] == b"ftyp" and data[8:12] in HEIF_BRANDS:
+        return data, HEIF_BRANDS[data[8:12]], None
+    
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Exception:
+        raise ValueError("지원하지 않는 이미지 형식입니다")
+    
+    mime_type = GEMINI_INLINE_IMAGE_TYPES.get(image.format)
+    if mime_type is None:
+        try:
+            converted = io.BytesIO()
+            image.convert("RGB").save(converted, format="JPEG", quality=90)
+        except Exception:
+            raise ValueError(f"{image.format} 이미지를 읽을 수 없습니다")
+        return converted.getvalue(), "image/jpeg", image.size
+    
+    if not is_complete_image(data, image.format):
+        raise ValueError("이미지 데이터가 잘렸거나 손상되었습니다")
+    return data, mime_type, image.size
+
+class PipelineSession:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.latest_response = None  # 최신 응답 하나만 저장 (파이프라이닝)
+        self.response_lock = threading.Lock()  # 최신 응답 보호
+        self.response_ready = threading.Condition(self.response_lock)  # 새 응답 게시 알림 (/describe 대기 요청 깨움)
+        self.tts_status = {"is_speaking": False, "current_text": ""}
+        self.frames = FrameMailbox()  # 최신 업로드 프레임 (인코딩된 원본 바이트)
+        self.auto_processing = {"enabled": False, "thread": None}
+        self.stop_event = threading.Event()  # 스레드 중지 신호등
+        self.pending_requests = {}  # 대기 중인 요청들 추적
+        self.latest_dispatched_at = 0.0  # 마지막으로 게시된 응답의 요청 시각 (늦게 도착한 이전 프레임 응답 폐기용)
+        self.streaming_request_id = None  # 부분 응답을 스트리밍 중인 요청 (TTS가 이 요청의 문장을 읽는 중에도 이어서 전달)
+        self.streaming_previous_dispatched_at = 0.0  # 스트리밍 요청이 latest_dispatched_at을 올리기 전 값
+        self.broadcaster = ResponseBroadcaster(SSE_SUBSCRIBER_QUEUE_SIZE)
+        self.last_active = time.time()
+    
+    def touch(self):
+        self.last_active = time.time()
+    
+    def is_idle(self, now):
+        return now - self.last_active > PIPELINE_SESSION_IDLE_S and self.broadcaster.get_stats()["subscribers"] == 0
+    
+    def start_processing(self):
+        """자동 처리 워커를 시작합니다. 이미 실행 중이면 False."""
+        if self.auto_processing["enabled"]:
+            return False
+        self.stop_event.clear()  # 중지 신호 해제 (초록불)
+        self.auto_processing["enabled"] = True
+        self.auto_processing["thread"] = threading.Thread(target=continuous_processing_worker, args=(self,), daemon=True)
+        self.auto_processing["thread"].start()
+        return True
+    
+    def stop_processing(self):
+        """워커를 멈추고 프레임, 응답, 대기 중인 요청을 비웁니다."""
+        self.stop_event.set()
+        gemini_dispatcher.wake()  # 키 슬롯을 기다리는 워커도 즉시 깨움
+        self.auto_processing["enabled"] = False
+        
+        # 현재 이미지와 응답 클리어
+        self.frames.clear()
+        
+        with self.response_lock:
+            self.latest_response = None
+            self.response_ready.notify_all()  # 응답을 기다리는 /describe 요청 즉시 종료
+        self.broadcaster.publish("stopped", {"timestamp": time.time()})
+        
+        # 대기 중인 요청들도 클리어
+        self.pending_requests.clear()
+        
+        # 스레드가 정상 종료될 때까지 대기
+        thread = self.auto_processing["thread"]
+        if thread and thread.is_alive() and thread is not threading.current_thread():
+            logger.info(f"🔄 [{self.session_id}] 백그라운드 스레드 종료 대기 중...")
+            # Event 방식이므로 빠르게 종료됨 (최대 2초)
+            thread.join(timeout=2.0)
+            if thread.is_alive():
+                logger.warning(f"⚠️ [{self.session_id}] 백그라운드 스레드가 2초 내 종료되지 않음")
+            else:
+                logger.info(f"✅ [{self.session_id}] 백그라운드 스레드 정상 종료됨")
+        
+        self.auto_processing["thread"] = None
+    
+    def get_stats(self):
+        with self.response_lock:
+            has_response = self.latest_response is not None
+        return {
+            "session_id": self.session_id,
+            "has_latest_response": has_response,
+            "auto_processing": self.auto_processing["enabled"],
+            "tts_speaking": self.tts_status["is_speaking"],
+            "pending_requests": len(self.pending_requests),
+            "idle_s": round(time.time() - self.last_active, 1)
+        }
+
+class PipelineSessionsFull(RuntimeError):
+    """활성 세션이 한도에 도달했고 정리할 수 있는 유휴 세션도 없을 때 발생합니다."""
+
+class PipelineSessionManager:
+    def __init__(self, idle_timeout_s, max_sessions):
+        self.idle_timeout_s = idle_timeout_s
+        self.max_sessions = max(1, max_sessions)
+        self._sessions = OrderedDict()  # session_id -> PipelineSession, 가장 오래 안 쓴 세션이 앞
+        self._lock = threading.Lock()
+        self._janitor = None
+        self.stats = {"created": 0, "evicted": 0, "rejected": 0}
+    
+    def get(self, session_id):
+        """
+        세션을 가져오거나 새로 만들고 활동 시각을 갱신합니다.
+        한도에 도달하면 유휴 세션(스트림 구독자 없이 PIPELINE_SESSION_IDLE_S 이상 요청이 없던 세션)만 정리하고,
+        그래도 자리가 없으면 PipelineSessionsFull을 발생시킵니다 (사용 중인 세션은 밀어내지 않음).
+        """
+        evicted = []
+        with self._lock:
+            pipeline = self._sessions.get(session_id)
+            if pipeline is None:
+                if len(self._sessions) >= self.max_sessions:
+                    now = time.time()
+                    for idle_id in [idle_id for idle_id, idle in self._sessions.items() if idle.is_idle(now)]:
+                        evicted.append(self._sessions.pop(idle_id))
+                        if len(self._sessions) < self.max_sessions:
+                            break
+                if len(self._sessions) >= self.max_sessions:
+                    self.stats["rejected"] += 1
+                    raise PipelineSessionsFull(f"동시 세션 한도({self.max_sessions}개)에 도달했습니다")
+                pipeline = PipelineSession(session_id)
+                self._sessions[session_id] = pipeline
+                self.stats["created"] += 1
+                logger.info(f"👤 파이프라인 세션 생성: {session_id} (세션 {len(self._sessions)}개)")
+            self._sessions.move_to_end(session_id)
+            pipeline.touch()
+            self._ensure_janitor()
+        
+        for idle in evicted:
+            self._evict(idle, "세션 수 한도 도달로 유휴 세션 정리")
+        return pipeline
+    
+    def evict_idle(self):
+        now = time.time()
+        with self._lock:
+            idle = [pipeline for pipeline in self._sessions.values() if pipeline.is_idle(now)]
+            for pipeline in idle:
+                del self._sessions[pipeline.session_id]
+        for pipeline in idle:
+            self._evict(pipeline, f"{PIPELINE_SESSION_IDLE_S:.0f}초 이상 유휴")
+    
+    def processing_count(self):
+        """자동 처리 워커가 실행 중인 세션 수 (Gemini 키를 함께 나눠 쓰는 스트림 수)."""
+        with self._lock:
+            return sum(pipeline.auto_processing["enabled"] for pipeline in self._sessions.values())
+    
+    def get_stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            stats = dict(self.stats)
+        stats["active"] = len(sessions)
+        stats["processing"] = sum(pipeline.auto_processing["enabled"] for pipeline in sessions)
+        return stats
+    
+    def _evict(self, pipeline, reason):
+        pipeline.stop_processing()
+        with self._lock:
+            self.stats["evicted"] += 1
+        logger.info(f"🧹 파이프라인 세션 제거: {pipeline.session_id} ({reason})")
+    
+    def _ensure_janitor(self):
+        if self._janitor is None or not self._janitor.is_alive():
+            self._janitor = threading.Thread(target=self._janitor_loop, daemon=True)
+            self._janitor.start()
+    
+    def _janitor_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout_s / 4))
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"세션 정리 오류: {e}")
+
+pipeline_sessions = PipelineSessionManager(PIPELINE_SESSION_IDLE_S, PIPELINE_MAX_SESSIONS)
+
+@app.errorhandler(PipelineSessionsFull)
+def pipeline_sessions_full(e):
+    logger.warning(f"⏳ 새 세션 거절: {e}")
+    response = jsonify({"error": "동시 사용자가 많아 지금은 연결할 수 없습니다. 잠시 후 다시 시도해주세요.", "status": "busy"})
+    response.headers["Retry-After"] = "30"
+    return response, 503
+
+def get_client_id(data=None):
+    """요청한 클라이언트의 식별자 (X-Client-Id 헤더, clientId 값, 접속 IP 순)."""
+    client_id = request.headers.get('X-Client-Id') or request.values.get('clientId')
+    if not client_id and data:
+        client_id = data.get('clientId')
+    return client_id or request.remote_addr
+
+def get_pipeline_session(data=None):
+    """요청한 클라이언트의 파이프라인 세션."""
+    return pipeline_sessions.get(get_client_id(data))
 
 # --- Gemini API 키 3개 설정 ---
 api_keys = []
@@ -106,7 +447,7 @@ SUPPORTED_MODELS = {
 }
 
 # --- Gemini 모델 설정 ---
-models = []
+# google.generativeai는 import 비용이 커서 첫 호출 시점에 로드
 generation_config = {
   "temperature": 0.4,
   "top_p": 1,
@@ -120,24 +461,335 @@ safety_settings = [
   {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
 ]
 
-for key in api_keys:
-    genai.configure(api_key=key)
-    model = genai.GenerativeModel(
-        model_name='gemini-2.0-flash',
-        generation_config=generation_config,
-        safety_settings=safety_settings
-    )
-    models.append(model)
-
-def get_gemini_model(model_name, api_key):
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel(
-        model_name=model_name,
-        generation_config=generation_config,
-        safety_settings=safety_settings
-    )
+class GeminiClientPool:
+    """
+    API 키마다 GenerativeService 클라이언트를 한 번만 만들어 (gRPC 채널/연결 유지)
+    모델 이름별 GenerativeModel과 함께 재사용합니다.
+    genai.configure(전역 상태)를 호출하지 않고 키별 클라이언트를 모델에 직접 연결하므로
+    여러 스레드가 서로 다른 키로 동시에 호출해도 키가 섞이지 않습니다.
+    
+    클라이언트 연결은 GenerativeModel의 비공개 속성(_client)에 의존하므로
+    requirements.txt에 고정한 google-generativeai 0.8.x에서만 허용합니다.
+    """
+    
+    SUPPORTED_GENAI_VERSION = "0.8."
+    
+    def __init__(self, api_keys):
+        self.api_keys = api_keys
+        self._clients = {}  # api_idx -> GenerativeServiceClient
+        self._models = {}  # (model_name, api_idx) -> GenerativeModel
+        self._lock = threading.Lock()
+    
+    def model(self, model_name, api_idx):
+        key = (model_name, api_idx)
+        with self._lock:
+            if key not in self._models:
+                model = self._new_model(model_name)
+                self._attach_client(model, api_idx)
+                self._models[key] = model
+            return self._models[key]
+    
+    def get_stats(self):
+        with self._lock:
+            return {"clients": len(self._clients), "models": len(self._models)}
+    
+    def _client(self, api_idx):
+        from google.ai import generativelanguage as glm
+        
+        if api_idx not in self._clients:
+            self._clients[api_idx] = glm.GenerativeServiceClient(client_options=self._client_options(api_idx))
+        return self._clients[api_idx]
+    
+    def _attach_client(self, model, api_idx):
+        """키별 클라이언트를 모델에 연결합니다. 검증하지 않은 라이브러리 버전이면 키가 섞이지 않도록 바로 실패."""
+        import google.generativeai as genai
+        
+        version = getattr(genai, "__version__", "unknown")
+        if not version.startswith(self.SUPPORTED_GENAI_VERSION) or "_client" not in vars(model):
+            raise RuntimeError(
+                f"google-generativeai {version}에서는 키별 클라이언트를 연결할 수 없습니다 "
+                f"({self.SUPPORTED_GENAI_VERSION}x 필요, requirements.txt 참고)"
+            )
+        model._client = self._client(api_idx)
+    
+    def _client_options(self, api_idx):
+        from google.api_core import client_options as client_options_lib
+        
+        return client_options_lib.ClientOptions(api_key=self.api_keys[api_idx])
+    
+    @staticmethod
+    def _new_model(model_name):
+        import google.generativeai as genai
+        
+        return genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+        )
+
+gemini_pool = GeminiClientPool(api_keys)
+
+# --- Gemini 호출 디스패처 ---
+# 호출마다 스레드를 만들지 않고 고정 크기 스레드 풀에서 실행하며, API 키별 동시 요청 수를 제한
+# 모든 키가 한도까지 사용 중이면 새 요청을 쌓지 않고 슬롯이 빌 때까지 기다렸다가 그 시점의 최신 프레임을 보냄
+GEMINI_MAX_IN_FLIGHT_PER_KEY = int(os.getenv("GEMINI_MAX_IN_FLIGHT_PER_KEY", "2"))
+# 적응형 호출 간격: 사용 가능한 키마다 GEMINI_MAX_IN_FLIGHT_PER_KEY개의 요청이 진행 중이도록
+# 키별 응답시간 EWMA로 간격을 계산 (키 k는 응답시간 / 목표 동시 요청 수마다 하나씩)
+# GEMINI_TARGET_INTERVAL_MS는 아직 응답시간 표본이 없을 때 쓰는 초기 간격
+# 여러 세션이 자동 처리 중이면 각 세션은 이 간격 x 처리 중인 세션 수마다 보내 전체 속도를 유지
+GEMINI_TARGET_INTERVAL_MS = float(os.getenv("GEMINI_TARGET_INTERVAL_MS", "1000"))
+GEMINI_LATENCY_EWMA_ALPHA = float(os.getenv("GEMINI_LATENCY_EWMA_ALPHA", "0.3"))
+# 키별 서킷 브레이커: 연속 실패 시 쿨다운 동안 제외, 429(할당량 초과)는 즉시 더 긴 쿨다운
+# 쿨다운이 끝나면 요청 하나로 시험(half-open)하고, 다시 실패하면 쿨다운을 두 배로 (최대값까지)
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "3"))
+GEMINI_BREAKER_COOLDOWN_S = float(os.getenv("GEMINI_BREAKER_COOLDOWN_S", "10"))
+GEMINI_RATE_LIMIT_COOLDOWN_S = float(os.getenv("GEMINI_RATE_LIMIT_COOLDOWN_S", "60"))
+GEMINI_BREAKER_MAX_COOLDOWN_S = float(os.getenv("GEMINI_BREAKER_MAX_COOLDOWN_S", "300"))
+
+class GeminiDispatcher:
+    LATENCY_PRIOR_S = 2.5  # 응답시간 표본이 하나도 없을 때 쓰는 값 (관측된 호출당 2.3~2.8초)
+    
+    def __init__(self, num_keys, max_in_flight_per_key, target_interval_ms=1000, ewma_alpha=0.3):
+        self.num_keys = num_keys
+        self.max_in_flight_per_key = max(1, max_in_flight_per_key)
+        self.target_interval = max(0.05, target_interval_ms / 1000.0)
+        self.ewma_alpha = ewma_alpha
+        self._executor = ThreadPoolExecutor(max_workers=num_keys * self.max_in_flight_per_key, thread_name_prefix="gemini")
+        self._keys = [{
+            "in_flight": 0,
+            "latency_ewma": None,  # 성공한 호출의 응답시간(초) EWMA
+            "error_ewma": 0.0,  # 실패율 EWMA
+            "requests": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "consecutive_failures": 0,
+            "open_until": 0.0,  # 0이면 정상(closed), 그 외에는 쿨다운 종료 시각
+            "probe_started_at": 0.0,  # half-open 시험 요청을 보낸 시각 (서킷이 열려 있고 아직 안 보냈으면 inf)
+            "cooldown": 0.0
+        } for _ in range(num_keys)]
+        self._next_idx = 0
+        self._cond = threading.Condition()
+        self.stats = {"dispatched": 0, "completed": 0, "saturated": 0}
+    
+    def acquire(self):
+        """
+        사용 가능한 키 중 가장 건강한 키의 슬롯을 잡고 인덱스를 반환합니다. 모두 사용 중이거나 쿨다운이면 None.
+        점수는 응답시간 EWMA x (진행 중 요청 + 1) / 성공률입니다.
+        """
+        with self._cond:
+            now = time.time()
+            candidates = [
+                (self._next_idx + offset) % self.num_keys for offset in range(self.num_keys)
+                if self._available((self._next_idx + offset) % self.num_keys, now)
+            ]
+            if not candidates:
+                self.stats["saturated"] += 1
+                return None
+            
+            api_idx = min(candidates, key=self._score)
+            key = self._keys[api_idx]
+            if key["open_until"]:
+                # 쿨다운이 끝난 키의 시험 요청
+                key["probe_started_at"] = now
+            key["in_flight"] += 1
+            self._next_idx = (api_idx + 1) % self.num_keys
+            return api_idx
+    
+    def submit(self, api_idx, fn, *args):
+        """acquire()로 잡은 슬롯에서 fn을 실행합니다. 끝나면 슬롯을 반납합니다."""
+        with self._cond:
+            self.stats["dispatched"] += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._release(api_idx))
+        return future
+    
+    def record_result(self, api_idx, success, processing_time=0.0, rate_limited=False, started_at=None):
+        """
+        호출 결과로 키의 응답시간·실패율 EWMA와 서킷 브레이커 상태를 갱신합니다.
+        서킷이 열리기 전에 보낸 요청(started_at이 시험 요청보다 이전)의 늦은 실패는 쿨다운을 늘리지 않습니다.
+        """
+        with self._cond:
+            key = self._keys[api_idx]
+            key["requests"] += 1
+            key["error_ewma"] = self.ewma_alpha * (0.0 if success else 1.0) + (1 - self.ewma_alpha) * key["error_ewma"]
+            
+            if success:
+                if key["latency_ewma"] is None:
+                    key["latency_ewma"] = processing_time
+                else:
+                    key["latency_ewma"] = self.ewma_alpha * processing_time + (1 - self.ewma_alpha) * key["latency_ewma"]
+                if key["open_until"]:
+                    logger.info(f"✅ API {api_idx} 복구됨 - 서킷 닫힘")
+                key.update(consecutive_failures=0, open_until=0.0, cooldown=0.0)
+                return
+            
+            key["errors"] += 1
+            key["consecutive_failures"] += 1
+            if key["open_until"] and started_at is not None and started_at < key["probe_started_at"]:
+                return
+            if rate_limited:
+                key["rate_limited"] += 1
+                cooldown = max(GEMINI_RATE_LIMIT_COOLDOWN_S, key["cooldown"] * 2)
+                reason = "할당량 초과(429)"
+            elif key["open_until"] or key["consecutive_failures"] >= GEMINI_BREAKER_FAILURES:
+                # 시험 요청 실패 또는 연속 실패 한도 도달
+                cooldown = key["cooldown"] * 2 if key["cooldown"] else GEMINI_BREAKER_COOLDOWN_S
+                reason = f"연속 실패 {key['consecutive_failures']}회"
+            else:
+                return
+            
+            key["cooldown"] = min(cooldown, GEMINI_BREAKER_MAX_COOLDOWN_S)
+            key["open_until"] = time.time() + key["cooldown"]
+            key["probe_started_at"] = float("inf")
+            logger.warning(f"⛔ API {api_idx} 서킷 열림 - {key['cooldown']:.0f}초 동안 제외 ({reason})")
+    
+    def next_interval(self):
+        """
+        다음 요청까지의 간격(초).
+        키 k가 목표 동시 요청 수(half-open이면 1)를 유지하려면 응답시간 EWMA / 목표 수마다 하나씩 보내야 하므로
+        사용 가능한 키들의 요청 속도를 더한 값의 역수를 간격으로 씁니다. 응답도 대략 이 간격마다 도착합니다.
+        응답시간 표본이 없는 키는 다른 키들의 평균으로 계산하고, 표본이 하나도 없으면 초기 간격을 씁니다.
+        """
+        with self._cond:
+            now = time.time()
+            known = [key["latency_ewma"] for key in self._keys if key["latency_ewma"] is not None]
+            if not known:
+                return self.target_interval
+            mean_latency = sum(known) / len(known)
+            rate = 0.0
+            for key in self._keys:
+                if now < key["open_until"]:
+                    continue
+                in_flight_target = 1 if key["open_until"] else self.max_in_flight_per_key
+                latency = key["latency_ewma"] if key["latency_ewma"] is not None else mean_latency
+                rate += in_flight_target / max(0.05, latency)
+        if rate == 0.0:
+            # 모든 키가 쿨다운 중 - wait_for_slot이 키가 풀릴 때까지 기다림
+            return self.target_interval
+        return 1.0 / rate
+    
+    def wait_for_slot(self, timeout, stop_event):
+        """사용 가능한 키의 슬롯이 비거나 stop_event가 설정될 때까지 최대 timeout초 기다립니다."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: stop_event.is_set() or any(self._available(idx, time.time()) for idx in range(self.num_keys)),
+                timeout
+            )
+    
+    def wake(self):
+        with self._cond:
+            self._cond.notify_all()
+    
+    def get_stats(self):
+        with self._cond:
+            now = time.time()
+            keys = []
+            for api_idx, key in enumerate(self._keys):
+                if not key["open_until"]:
+                    state = "closed"
+                elif now < key["open_until"]:
+                    state = "open"
+                else:
+                    state = "half_open"
+                keys.append({
+                    "api_idx": api_idx,
+                    "state": state,
+                    "in_flight": key["in_flight"],
+                    "latency_ewma": round(key["latency_ewma"], 3) if key["latency_ewma"] is not None else None,
+                    "error_rate": round(key["error_ewma"], 3),
+                    "requests": key["requests"],
+                    "errors": key["errors"],
+                    "rate_limited": key["rate_limited"],
+                    "cooldown_remaining": round(max(0.0, key["open_until"] - now), 1)
+                })
+            return {
+                **self.stats,
+                "in_flight": sum(key["in_flight"] for key in self._keys),
+                "max_in_flight_per_key": self.max_in_flight_per_key,
+                "target_interval": self.target_interval,
+                "next_api_idx": self._next_idx,
+                "keys": keys
+            }
+    
+    def _available(self, api_idx, now):
+        key = self._keys[api_idx]
+        if now < key["open_until"]:
+            return False
+        # half-open 상태에서는 시험 요청 하나만 허용
+        limit = 1 if key["open_until"] else self.max_in_flight_per_key
+        return key["in_flight"] < limit
+    
+    def _score(self, api_idx):
+        # 응답시간 표본이 없는 키(아직 성공한 적 없는 키)는 다른 키들의 평균 또는 사전값으로 계산하되 실패율은 그대로 반영
+        key = self._keys[api_idx]
+        latency = key["latency_ewma"]
+        if latency is None:
+            known = [other["latency_ewma"] for other in self._keys if other["latency_ewma"] is not None]
+            latency = sum(known) / len(known) if known else self.LATENCY_PRIOR_S
+        return latency * (key["in_flight"] + 1) / max(0.05, 1.0 - key["error_ewma"])
+    
+    def _release(self, api_idx):
+        with self._cond:
+            self._keys[api_idx]["in_flight"] -= 1
+            self.stats["completed"] += 1
+            self._cond.notify_all()
+
+gemini_dispatcher = GeminiDispatcher(len(api_keys), GEMINI_MAX_IN_FLIGHT_PER_KEY, GEMINI_TARGET_INTERVAL_MS, GEMINI_LATENCY_EWMA_ALPHA)
+
+# 토큰 스트리밍: 생성이 끝나기 전에 문장 단위로 부분 응답을 "partial" 이벤트로 전달해 TTS를 먼저 시작
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "0") == "1"
+# 문장 경계: 마침표/물음표/느낌표 뒤 공백 ("2.5미터" 같은 소수점은 경계가 아님) 또는 줄바꿈
+SENTENCE_BOUNDARY = re.compile(r'[.!?。](?=\s)|\n')
+
+def split_complete_sentences(text):
+    """마지막 문장 경계까지의 완성된 부분과 아직 끝나지 않은 나머지로 나눕니다."""
+    boundary = None
+    for boundary in SENTENCE_BOUNDARY.finditer(text):
+        pass
+    if boundary is None:
+        return "", text
+    return text[:boundary.end()], text[boundary.end():]
+
+class GeminiContentBlocked(ValueError):
+    """안전 필터 차단이나 빈 후보처럼 응답 내용에 텍스트가 없을 때 발생합니다 (키 상태와 무관)."""
+
+# 텍스트 없이 끝난 후보 중 내용 문제로 보는 종료 사유
+BLOCKED_FINISH_REASONS = {"SAFETY", "OTHER", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII"}
+
+def response_text(response):
+    """
+    응답(또는 스트리밍 청크)의 텍스트를 반환합니다.
+    .text 접근자는 파트가 없으면 원인 구분 없는 ValueError를 내므로 먼저 차단 여부를 확인합니다.
+    """
+    block_reason = getattr(getattr(response, "prompt_feedback", None), "block_reason", 0)
+    if block_reason:
+        raise GeminiContentBlocked(f"프롬프트 차단: {getattr(block_reason, 'name', block_reason)}")
+    if not response.candidates:
+        raise GeminiContentBlocked("응답 후보 없음")
+    candidate = response.candidates[0]
+    if not candidate.content.parts:
+        finish_reason = getattr(candidate.finish_reason, "name", str(candidate.finish_reason))
+        if finish_reason in BLOCKED_FINISH_REASONS:
+            raise GeminiContentBlocked(f"응답 차단: {finish_reason}")
+        return ""  # 스트리밍의 마지막 청크처럼 텍스트 없이 정상 종료된 경우
+    return response.text
+
+def is_content_blocked(error):
+    """차단/빈 응답으로 인한 예외인지 확인합니다 (스트리밍 중 SDK가 내는 차단 예외 포함)."""
+    if isinstance(error, GeminiContentBlocked):
+        return True
+    try:
+        from google.generativeai.types import BlockedPromptException, StopCandidateException
+    except ImportError:
+        return False
+    return isinstance(error, (BlockedPromptException, StopCandidateException))
 
-def analyze_image_single(image_pil, api_idx, model_name='gemini-2.0-flash'):
+def analyze_image_single(frame, api_idx, model_name='gemini-2.0-flash', on_partial=None):
+    """
+    이미지를 Gemini로 분석합니다.
+    frame은 FrameMailbox 프레임이며, 업로드된 인코딩 바이트를 디코딩이나 재인코딩 없이 그대로 전송합니다.
+    on_partial이 주어지면 stream=True로 생성하며 문장이 완성될 때마다 on_partial(문장)을 호출합니다.
+    """
     prompt_parts = [
         """당신은 시각장애인의 안전한 보행을 돕는 전문 보조 AI입니다. 
 
@@ -177,129 +829,226 @@ def analyze_image_single(image_pil, api_idx, model_name='gemini-2.0-flash'):
 - "왼쪽에 7번 버스 정류장이 있습니다."
 
 지금 이미지를 분석해주세요:""",
-        image_pil,
+        {"mime_type": frame["mime_type"], "data": frame["data"]},
     ]
     
     try:
         start_time = time.time()
-        api_key = api_keys[api_idx]
-        model = get_gemini_model(model_name, api_key)
-        response = model.generate_content(prompt_parts)
+        model = gemini_pool.model(model_name, api_idx)
+        first_partial_time = None
+        
+        if on_partial is None:
+            description = response_text(model.generate_content(prompt_parts)).strip()
+        else:
+            description, pending = "", ""
+            for chunk in model.generate_content(prompt_parts, stream=True):
+                text = response_text(chunk)
+                description += text
+                complete, pending = split_complete_sentences(pending + text)
+                if complete.strip():
+                    if first_partial_time is None:
+                        first_partial_time = time.time() - start_time
+                        logger.info(f"✂️ API {api_idx} 첫 문장 {first_partial_time:.3f}초에 전달")
+                    on_partial(complete.strip())
+            if pending.strip():
+                on_partial(pending.strip())
+            description = description.strip()
+        
+        if not description:
+            raise GeminiContentBlocked("빈 응답")
+        
         end_time = time.time()
         
         processing_time = end_time - start_time
         logger.info(f"✅ API {api_idx}에서 {processing_time:.3f}초에 응답 완료")
         
         return {
-            "description": response.text.strip(),
+            "description": description,
             "api_idx": api_idx,
             "processing_time": processing_time,
+            "first_partial_time": first_partial_time,
             "model_name": model_name,
-            "success": True
+            "success": True,
+            "rate_limited": False,
+            "invalid_request": False,
+            "content_blocked": False
         }
         
     except Exception as e:
-        logger.error(f"❌ API {api_idx} 호출 실패: {e}")
+        content_blocked = is_content_blocked(e)
+        if content_blocked:
+            logger.warning(f"🚫 API {api_idx} 응답 차단/빈 응답: {e}")
+        else:
+            logger.error(f"❌ API {api_idx} 호출 실패: {e}")
         return {
             "description": "분석 중 오류가 발생했습니다.",
             "api_idx": api_idx,
             "processing_time": 0,
+            "first_partial_time": None,
             "model_name": model_name,
-            "success": False
+            "success": False,
+            # google.api_core의 ResourceExhausted/TooManyRequests는 code 429
+            "rate_limited": getattr(e, "code", None) == 429,
+            # InvalidArgument(400)는 요청 내용 문제이므로 키 상태에 반영하지 않음
+            "invalid_request": getattr(e, "code", None) == 400,
+            # 안전 필터 차단/빈 응답도 프레임 내용 문제이므로 키 상태에 반영하지 않음
+            "content_blocked": content_blocked
         }
 
-def process_api_response(request_id, api_idx, result):
-    global latest_response
+def publish_partial(pipeline, request_id, api_idx, dispatched_at, index, text):
+    """
+    스트리밍 중인 응답의 완성된 문장을 "partial" 이벤트로 전달합니다.
+    첫 문장을 전달한 요청이 스트림을 차지하므로 그보다 먼저 보낸 요청의 문장과 최종 응답은 버려지고,
+    TTS가 이 요청의 앞 문장을 읽는 중에도 뒤 문장은 계속 전달됩니다.
+    스트림은 첫 문장(#0)에서만 차지할 수 있어, 앞 문장이 버려진 요청은 나머지 문장도 버리고
+    최종 응답을 일반 경로로 전체 게시합니다 (첫 문장의 위험 안내가 빠지지 않도록).
+    """
+    if pipeline.stop_event.is_set():
+        return
     
-    if request_id in pending_requests:
-        del pending_requests[request_id]
+    with pipeline.response_lock:
+        if pipeline.streaming_request_id != request_id and index != 0:
+            return
+        if pipeline.tts_status["is_speaking"] and pipeline.streaming_request_id != request_id:
+            return
+        if dispatched_at < pipeline.latest_dispatched_at:
+            return
+        if pipeline.streaming_request_id != request_id:
+            # 이 요청이 스트림을 차지하기 전의 요청 시각 (실패 시 되돌림)
+            pipeline.streaming_previous_dispatched_at = pipeline.latest_dispatched_at
+        pipeline.latest_dispatched_at = dispatched_at
+        pipeline.streaming_request_id = request_id
+        pipeline.broadcaster.publish("partial", {
+            "timestamp": time.time(),
+            "text": text,
+            "index": index,
+            "api_idx": api_idx,
+            "request_id": request_id
+        })
+    logger.info(f"✂️ API {api_idx} 부분 응답 #{index} 전달: {text[:30]}... (요청 ID: {request_id[:8]})")
+
+def process_api_response(pipeline, request_id, api_idx, result):
+    if request_id in pipeline.pending_requests:
+        del pipeline.pending_requests[request_id]
     
-    if stop_event.is_set():
+    if pipeline.stop_event.is_set():
         logger.info(f"🗑️ API {api_idx} 응답 버림 - 시스템 중지됨 (요청 ID: {request_id[:8]})")
         return
     
-    if tts_status["is_speaking"]:
+    # 부분 응답을 스트리밍한 요청의 최종 응답은 TTS 진행 중이어도 게시 (TTS가 읽는 중인 바로 그 응답)
+    if pipeline.tts_status["is_speaking"] and pipeline.streaming_request_id != request_id:
         logger.info(f"🗑️ API {api_idx} 응답 버림 - TTS 진행 중 (요청 ID: {request_id[:8]})")
         return
     
     if not result["success"]:
         logger.warning(f"🗑️ API {api_idx} 응답 버림 - 호출 실패 (요청 ID: {request_id[:8]})")
+        with pipeline.response_lock:
+            if pipeline.streaming_request_id == request_id:
+                # 문장을 보내던 중 실패: 스트림을 놓아주고, 다른 요청의 응답이 버려지지 않도록 요청 시각도 되돌림
+                pipeline.streaming_request_id = None
+                if pipeline.latest_dispatched_at == result["dispatched_at"]:
+                    pipeline.latest_dispatched_at = pipeline.streaming_previous_dispatched_at
+                pipeline.broadcaster.publish("partial_end", {
+                    "timestamp": time.time(),
+                    "request_id": request_id,
+                    "api_idx": api_idx,
+                    "success": False
+                })
         return
     
-    with response_lock:
-        latest_response = {
+    with pipeline.response_lock:
+        # 더 나중에 보낸 프레임의 응답이 이미 게시됐으면 이 응답은 오래된 장면
+        if result["dispatched_at"] < pipeline.latest_dispatched_at:
+            logger.info(f"🗑️ API {api_idx} 응답 버림 - 더 최신 프레임 응답이 이미 도착함 (요청 ID: {request_id[:8]})")
+            return
+        pipeline.latest_dispatched_at = result["dispatched_at"]
+        pipeline.latest_response = {
             "timestamp": time.time(),
             "description": result["description"],
             "api_idx": result["api_idx"],
             "processing_time": result["processing_time"],
             "model_name": result["model_name"],
-            "request_id": request_id
+            "request_id": request_id,
+            # 부분 응답으로 이미 전달된 내용이면 스트림 클라이언트는 다시 읽지 않아도 됨
+            "streamed": pipeline.streaming_request_id == request_id
         }
+        if pipeline.streaming_request_id == request_id:
+            pipeline.streaming_request_id = None
+        pipeline.response_ready.notify_all()
+        pipeline.broadcaster.publish("description", pipeline.latest_response)
         logger.info(f"🔄 API {api_idx} 최신 응답으로 업데이트됨 (요청 ID: {request_id[:8]})")
 
-def continuous_processing_worker():
+def api_call_worker(pipeline, request_id, api_idx, frame, dispatched_at):
+    if pipeline.stop_event.is_set():
+        logger.info(f"🛑 API {api_idx} 호출 취소됨")
+        if request_id in pipeline.pending_requests:
+            del pipeline.pending_requests[request_id]
+        return
+    
+    on_partial = None
+    if GEMINI_STREAMING:
+        partial_index = itertools.count()
+        on_partial = lambda text: publish_partial(pipeline, request_id, api_idx, dispatched_at, next(partial_index), text)
+    
+    result = analyze_image_single(frame, api_idx, on_partial=on_partial)
+    result["dispatched_at"] = dispatched_at
+    if result["invalid_request"] or result["content_blocked"]:
+        # 잘못된 이미지나 차단된 프레임 등 요청 내용의 문제 - 다른 세션이 함께 쓰는 키의 서킷 브레이커에 반영하지 않음
+        logger.warning(f"⚠️ API {api_idx} 요청 내용 문제 - 키 상태에는 반영하지 않음 (요청 ID: {request_id[:8]})")
+    else:
+        gemini_dispatcher.record_result(api_idx, result["success"], result["processing_time"], result["rate_limited"], dispatched_at)
+    process_api_response(pipeline, request_id, api_idx, result)
+
+def continuous_processing_worker(pipeline):
     logger.info("🔄 자동 이미지 처리 워커 시작 (Event 기반)")
+    sent_version = 0  # 마지막으로 Gemini에 보낸 프레임 버전
     
-    while not stop_event.is_set():
+    while not pipeline.stop_event.is_set():
         try:
-            # 이미지가 없으면 0.1초 대기
-            with image_lock:
-                if current_image is None:
-                    # stop_event.wait()를 사용하여 중지 신호를 즉시 감지
-                    if stop_event.wait(timeout=0.1):  # 0.1초 대기 또는 중지 신호
-                        break
-                    continue
-                # 안전한 이미지 복사
-                image_array = np.array(current_image)
-                image_copy = Image.fromarray(image_array)
+            # 아직 보내지 않은 새 프레임이 올라올 때까지 최대 0.1초 대기 (같은 프레임은 다시 보내지 않음)
+            frame = pipeline.frames.wait_newer(sent_version, timeout=0.1)
+            if frame is None:
+                continue
             
             # 중지 신호 체크
-            if stop_event.is_set():
+            if pipeline.stop_event.is_set():
                 break
             
-            # API 선택
-            current_api_idx = api_rotation["current_idx"]
-            api_rotation["current_idx"] = (current_api_idx + 1) % len(api_keys)
+            # API 선택 (동시 요청 한도가 남은 키)
+            current_api_idx = gemini_dispatcher.acquire()
+            if current_api_idx is None:
+                # 모든 키가 응답 대기 중 - 이 프레임은 보내지 않고 슬롯이 비면 최신 프레임으로 다시 시도
+                gemini_dispatcher.wait_for_slot(timeout=1.0, stop_event=pipeline.stop_event)
+                continue
             
             # 요청 ID 생성
             request_id = f"req_{int(time.time() * 1000)}_{current_api_idx}"
+            sent_version = frame["version"]
+            pipeline.frames.mark_sent(frame)
             
-            logger.info(f"🔍 API {current_api_idx}로 이미지 분석 시작 (요청 ID: {request_id[:8]})")
+            logger.info(f"🔍 API {current_api_idx}로 프레임 #{sent_version} 분석 시작 (요청 ID: {request_id[:8]})")
             
             # 요청 등록
-            pending_requests[request_id] = {
+            dispatched_at = time.time()
+            pipeline.pending_requests[request_id] = {
                 "api_idx": current_api_idx,
-                "timestamp": time.time()
+                "timestamp": dispatched_at
             }
             
-            # API 호출 함수
-            def api_call_worker():
-                if stop_event.is_set():
-                    logger.info(f"🛑 API {current_api_idx} 호출 취소됨")
-                    if request_id in pending_requests:
-                        del pending_requests[request_id]
-                    return
-                
-                result = analyze_image_single(image_copy, current_api_idx)
-                process_api_response(request_id, current_api_idx, result)
+            # API 호출 시작 (스레드 풀에서 실행, 끝나면 키 슬롯 반납)
+            gemini_dispatcher.submit(current_api_idx, api_call_worker, pipeline, request_id, current_api_idx, frame, dispatched_at)
             
-            # 중지 신호 다시 체크
-            if stop_event.is_set():
-                break
-            
-            # API 호출 시작
-            api_thread = threading.Thread(target=api_call_worker, daemon=True)
-            api_thread.start()
-            
-            # 1초 대기 (중지 신호 즉시 반응)
-            if stop_event.wait(timeout=1.0):  # 1초 대기 또는 중지 신호
+            # 응답시간 EWMA 기반 간격만큼 대기 (중지 신호 즉시 반응)
+            # next_interval은 모든 키를 쓰는 스트림 하나의 간격이므로 처리 중인 세션 수만큼 늘려 키를 나눠 씀
+            interval = gemini_dispatcher.next_interval() * max(1, pipeline_sessions.processing_count())
+            if pipeline.stop_event.wait(timeout=interval):
                 logger.info("🛑 중지 신호 감지 - 워커 루프 종료")
                 break
             
         except Exception as e:
             logger.error(f"자동 처리 워커 오류: {e}")
             # 오류 시에도 1초 대기하되 중지 신호 즉시 반응
-            if stop_event.wait(timeout=1.0):
+            if pipeline.stop_event.wait(timeout=1.0):
                 break
     
     logger.info("🛑 자동 이미지 처리 워커 종료")
@@ -384,68 +1133,42 @@ def upload_image():
         return jsonify({"error": "이미지 파일이 없습니다"}), 400
     
     image_file = request.files['image']
+    pipeline = get_pipeline_session()
     
     try:
-        image_pil = Image.open(image_file.stream)
-        
-        with image_lock:
-            global current_image
-            current_image = image_pil
+        # 업로드 바이트를 그대로 보관 (헤더만 읽어 형식 확인, JPEG/PNG/WEBP/HEIC 외 형식만 JPEG로 변환)
+        image_bytes, mime_type, image_size = prepare_frame_bytes(image_file.read())
+        version = pipeline.frames.put(image_bytes, mime_type, image_size)
         
-        logger.info(f"📷 새 이미지 등록됨 - 크기: {image_pil.size}")
+        logger.info(f"📷 [{pipeline.session_id}] 새 이미지 등록됨 - 프레임 #{version}, 크기: {image_size}, {len(image_bytes)} bytes")
         
         return jsonify({
             "message": "이미지가 등록되었습니다. 자동 분석이 시작됩니다.",
-            "image_size": image_pil.size
+            "image_size": image_size,
+            "frame_version": version
         })
         
+    except ValueError as e:
+        logger.warning(f"이미지 업로드 거절: {e}")
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"이미지 업로드 오류: {e}")
         return jsonify({"error": "이미지 처리 중 오류가 발생했습니다"}), 500
 
 @app.route('/start_auto_processing', methods=['POST'])
 def start_auto_processing():
-    if auto_processing["enabled"]:
+    pipeline = get_pipeline_session()
+    if not pipeline.start_processing():
         return jsonify({"message": "자동 처리가 이미 실행 중입니다"})
     
-    stop_event.clear()  # 중지 신호 해제 (초록불)
-    auto_processing["enabled"] = True
-    auto_processing["thread"] = threading.Thread(target=continuous_processing_worker, daemon=True)
-    auto_processing["thread"].start()
-    
-    logger.info("🚀 자동 이미지 처리 시작됨")
+    logger.info(f"🚀 [{pipeline.session_id}] 자동 이미지 처리 시작됨")
     return jsonify({"message": "자동 이미지 처리가 시작되었습니다"})
 
 @app.route('/stop_auto_processing', methods=['POST'])
 def stop_auto_processing():
-    global latest_response, current_image
-    
-    stop_event.set()
-    auto_processing["enabled"] = False
-    
-    logger.info("🛑 중지 신호 전송됨")
-    
-    # 현재 이미지와 응답 클리어
-    with image_lock:
-        current_image = None
-    
-    with response_lock:
-        latest_response = None
-    
-    # 대기 중인 요청들도 클리어
-    pending_requests.clear()
-    
-    # 스레드가 정상 종료될 때까지 대기
-    if auto_processing["thread"] and auto_processing["thread"].is_alive():
-        logger.info("🔄 백그라운드 스레드 종료 대기 중...")
-        # Event 방식이므로 빠르게 종료됨 (최대 2초)
-        auto_processing["thread"].join(timeout=2.0)
-        if auto_processing["thread"].is_alive():
-            logger.warning("⚠️ 백그라운드 스레드가 2초 내 종료되지 않음")
-        else:
-            logger.info("✅ 백그라운드 스레드 정상 종료됨")
-    
-    auto_processing["thread"] = None
+    pipeline = get_pipeline_session()
+    logger.info(f"🛑 [{pipeline.session_id}] 중지 신호 전송됨")
+    pipeline.stop_processing()
     
     logger.info("⏹️ 파이프라이닝 시스템 완전 중지됨 (Event 기반)")
     
@@ -463,14 +1186,13 @@ def stop_auto_processing():
 
 @app.route('/get_response', methods=['GET'])
 def get_response():
-    global latest_response
-    
-    with response_lock:
-        if latest_response is None:
+    pipeline = get_pipeline_session()
+    with pipeline.response_lock:
+        if pipeline.latest_response is None:
             return jsonify({"message": "새로운 분석 결과가 없습니다"}), 204
         
-        response = latest_response.copy()
-        latest_response = None  # 사용 후 클리어
+        response = pipeline.latest_response.copy()
+        pipeline.latest_response = None  # 사용 후 클리어
         
         logger.info(f"📬 최신 응답 반환: {response['description'][:50]}...")
         return jsonify(response)
@@ -478,11 +1200,12 @@ def get_response():
 @app.route('/set_tts_status', methods=['POST'])
 def set_tts_status():
     data = request.get_json()
+    pipeline = get_pipeline_session(data)
     is_speaking = data.get('is_speaking', False)
     current_text = data.get('current_text', '')
     
-    tts_status["is_speaking"] = is_speaking
-    tts_status["current_text"] = current_text
+    pipeline.tts_status["is_speaking"] = is_speaking
+    pipeline.tts_status["current_text"] = current_text
     
     status = "시작" if is_speaking else "완료"
     logger.info(f"🗣️ TTS 상태 업데이트: {status} - '{current_text[:30]}...'")
@@ -491,27 +1214,66 @@ def set_tts_status():
 
 @app.route('/get_tts_status', methods=['GET'])
 def get_tts_status():
-    return jsonify(tts_status)
+    return jsonify(get_pipeline_session().tts_status)
 
 @app.route('/get_queue_status', methods=['GET'])
 def get_queue_status():
-    with response_lock:
-        has_response = latest_response is not None
+    pipeline = get_pipeline_session()
+    with pipeline.response_lock:
+        has_response = pipeline.latest_response is not None
         
     return jsonify({
         "has_latest_response": has_response,
-        "auto_processing": auto_processing["enabled"],
-        "tts_speaking": tts_status["is_speaking"],
+        "auto_processing": pipeline.auto_processing["enabled"],
+        "tts_speaking": pipeline.tts_status["is_speaking"],
         "available_apis": len(api_keys),
-        "current_api_idx": api_rotation["current_idx"],
-        "pending_requests": len(pending_requests),
-        "pending_details": list(pending_requests.keys())
+        "current_api_idx": gemini_dispatcher.get_stats()["next_api_idx"],
+        "dispatcher": gemini_dispatcher.get_stats(),
+        "pending_requests": len(pipeline.pending_requests),
+        "pending_details": list(pipeline.pending_requests.keys()),
+        "gemini_clients": gemini_pool.get_stats(),
+        "stream": pipeline.broadcaster.get_stats(),
+        "frames": pipeline.frames.get_stats(),
+        "session_id": pipeline.session_id,
+        "sessions": pipeline_sessions.get_stats()
     })
 
+@app.route('/stream_responses', methods=['GET'])
+def stream_responses():
+    """
+    새 분석 결과를 Server-Sent Events로 전달합니다 ("description" 이벤트, 중지 시 "stopped").
+    GEMINI_STREAMING이면 문장 단위 "partial" 이벤트가 먼저 오고, 그 요청이 실패하면 "partial_end"로 끝을 알립니다.
+    클라이언트는 /upload_image로 프레임만 올리고 결과는 이 스트림으로 받습니다.
+    """
+    pipeline = get_pipeline_session()
+    subscriber = pipeline.broadcaster.subscribe()
+    logger.info(f"📡 [{pipeline.session_id}] 응답 스트림 구독 시작 (구독자 {pipeline.broadcaster.get_stats()['subscribers']}명)")
+    
+    def generate():
+        try:
+            yield "retry: 1000\n\n"
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=SSE_KEEPALIVE_S)
+                except queue.Empty:
+                    # 프록시가 유휴 연결을 끊지 않도록 주석 줄 전송
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            pipeline.broadcaster.unsubscribe(subscriber)
+            pipeline.touch()  # 구독이 끝난 시점부터 유휴 시간 계산
+            logger.info(f"📡 [{pipeline.session_id}] 응답 스트림 구독 종료")
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # --- 기존 describe 엔드포인트 (호환성 유지하면서 병렬 처리 적용) ---
 @app.route('/describe', methods=['POST'])
 def describe():
-    global latest_response, current_image  # 글로벌 변수 선언
     request_start = time.time()
     
     model_id = request.form.get('model', 'gemini-2.0-flash')
@@ -525,40 +1287,37 @@ def describe():
         logger.warning(f"지원하지 않는 모델: {model_id}")
         return jsonify({"error": f"지원하지 않는 모델: {model_id}"}), 400
 
+    pipeline = get_pipeline_session()
     file_receive_start = time.time()
     image_file = request.files['image']
-    file_size = len(image_file.read())
-    image_file.seek(0)  # Reset file pointer
+    image_bytes = image_file.read()
+    file_size = len(image_bytes)
     file_receive_time = time.time() - file_receive_start
     logger.info(f"이미지 파일 수신 완료 - 크기: {file_size} bytes, 시간: {file_receive_time:.3f}s")
     
     try:
         pil_start = time.time()
-        image = Image.open(image_file.stream)
+        try:
+            image_bytes, mime_type, image_size = prepare_frame_bytes(image_bytes)
+        except ValueError as e:
+            logger.warning(f"이미지 거절: {e}")
+            return jsonify({"error": str(e)}), 400
         pil_time = time.time() - pil_start
-        logger.info(f"PIL 이미지 변환 완료 - 해상도: {image.size}, 시간: {pil_time:.3f}s")
+        logger.info(f"이미지 헤더 확인 완료 - 해상도: {image_size}, 형식: {mime_type}, 시간: {pil_time:.3f}s")
 
-        # 이미지를 글로벌 변수에 저장 (파이프라이닝용)
-        # numpy 배열로 변환 후 새 PIL 이미지 생성하여 파일 스트림 의존성 완전 제거
-        image_array = np.array(image)
-        independent_image = Image.fromarray(image_array)
-        
-        with image_lock:
-            current_image = independent_image
+        # 업로드 바이트를 그대로 프레임 우편함에 게시 (파이프라이닝용)
+        # bytes는 불변이므로 디코딩이나 복사 없이 워커와 Gemini 호출에 그대로 전달됨
+        pipeline.frames.put(image_bytes, mime_type, image_size)
         
         # 자동 처리가 안 돌고 있으면 시작
-        if not auto_processing["enabled"]:
-            stop_event.clear()  # 중지 신호 해제 (초록불)
-            auto_processing["enabled"] = True
-            auto_processing["thread"] = threading.Thread(target=continuous_processing_worker, daemon=True)
-            auto_processing["thread"].start()
-            logger.info("🚀 파이프라이닝 자동 시작됨")
+        if pipeline.start_processing():
+            logger.info(f"🚀 [{pipeline.session_id}] 파이프라이닝 자동 시작됨")
         
         # 기존 응답이 있으면 즉시 반환, 없으면 잠시 대기
-        with response_lock:
-            if latest_response is not None:
-                response = latest_response.copy()
-                latest_response = None
+        with pipeline.response_lock:
+            if pipeline.latest_response is not None:
+                response = pipeline.latest_response.copy()
+                pipeline.latest_response = None
                 logger.info(f"📬 기존 응답 즉시 반환: {response['description'][:50]}...")
                 return jsonify({
                     "description": response["description"],
@@ -567,27 +1326,24 @@ def describe():
                     "pipelining": True
                 })
         
-        # 새 응답을 최대 3초 대기
+        # 새 응답을 최대 3초 대기 (process_api_response가 게시하는 즉시 깨어남)
         max_wait_time = 3.0
-        wait_start = time.time()
         
-        while (time.time() - wait_start) < max_wait_time:
-            time.sleep(0.1)
-            
-            with response_lock:
-                if latest_response is not None:
-                    response = latest_response.copy()
-                    latest_response = None
-                    
-                    total_time = time.time() - request_start
-                    logger.info(f"📬 새 응답 반환 ({total_time:.3f}초 대기): {response['description'][:50]}...")
-                    
-                    return jsonify({
-                        "description": response["description"],
-                        "model_name": f"Gemini 2.0 Flash (API {response['api_idx']}) - 파이프라이닝",
-                        "processing_time": total_time,
-                        "pipelining": True
-                    })
+        with pipeline.response_ready:
+            pipeline.response_ready.wait_for(lambda: pipeline.latest_response is not None or pipeline.stop_event.is_set(), timeout=max_wait_time)
+            if pipeline.latest_response is not None:
+                response = pipeline.latest_response.copy()
+                pipeline.latest_response = None
+                
+                total_time = time.time() - request_start
+                logger.info(f"📬 새 응답 반환 ({total_time:.3f}초 대기): {response['description'][:50]}...")
+                
+                return jsonify({
+                    "description": response["description"],
+                    "model_name": f"Gemini 2.0 Flash (API {response['api_idx']}) - 파이프라이닝",
+                    "processing_time": total_time,
+                    "pipelining": True
+                })
         
         # 3초 대기해도 응답이 없으면 타임아웃
         total_time = time.time() - request_start
@@ -733,7 +1489,7 @@ def navigation_describe():
 
         api_start = time.time()
         logger.info(f"{model_config['name']} API call started for navigation...")
-        model = get_gemini_model(model_config['model_name'], api_keys[0])
+        model = gemini_pool.model(model_config['model_name'], 0)
         response = model.generate_content(prompt_parts)
         api_time = time.time() - api_start
         logger.info(f"{model_config['name']} API response completed - time: {api_time:.3f}s")
@@ -1058,51 +1814,508 @@ def clear_logs():
         return jsonify({"error": str(e)}), 500
 
 # --- 모델 및 디바이스 설정 ---
-DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
-depth_model = None
-try:
-    MODEL_CONFIGS = {
-        'small': {'encoder': 'vits', 'features': 64, 'out_channels': [48, 96, 192, 384]},
-    }
-    model_name = 'small'
-    depth_model = DepthAnythingV2(**MODEL_CONFIGS[model_name])
+# torch와 깊이 모델은 import 비용이 커서 워밍업 단계(initialize_depth_runtime)에서 로드
+# background: HTTP 서버가 즉시 응답하고 모델은 백그라운드에서 로드 (준비 전 깊이 요청은 "warming" 응답)
+# blocking: 기존처럼 모듈 로드 시 모델까지 로드
+DEPTH_STARTUP_MODE = os.getenv("DEPTH_STARTUP_MODE", "background")
+DEVICE = None
+# CPU 전용 배포용 동적 int8 양자화 (DEPTH_QUANTIZE=int8)
+DEPTH_QUANTIZE = os.getenv("DEPTH_QUANTIZE", "").lower()
+# 추론 해상도 (토큰 수가 해상도의 제곱에 비례하므로 가장 큰 지연시간 조절 수단)
+# 요청마다 inputSize로 선택 가능, 14의 배수만 허용
+DEPTH_INPUT_SIZES = tuple(int(size) for size in os.getenv("DEPTH_INPUT_SIZES", "252,364,518").split(","))
+DEPTH_INPUT_SIZE = int(os.getenv("DEPTH_INPUT_SIZE", "518"))
+if any(size % 14 for size in DEPTH_INPUT_SIZES) or DEPTH_INPUT_SIZE not in DEPTH_INPUT_SIZES:
+    raise ValueError(f"DEPTH_INPUT_SIZE({DEPTH_INPUT_SIZE})는 DEPTH_INPUT_SIZES{DEPTH_INPUT_SIZES} 중 하나여야 하며 모두 14의 배수여야 합니다")
+# 관심 영역 추론 모드 (요청마다 roiMode로 선택 가능)
+# full: 전체 프레임을 input_size로 추론
+# corridor: 중앙 보행 통로는 잘라서 원래 픽셀 밀도로, 주변부는 절반 해상도로 추론 (토큰 수 약 1/2)
+DEPTH_ROI_MODES = ('full', 'corridor')
+DEPTH_ROI_MODE = os.getenv("DEPTH_ROI_MODE", "full")
+if DEPTH_ROI_MODE not in DEPTH_ROI_MODES:
+    raise ValueError(f"DEPTH_ROI_MODE는 {DEPTH_ROI_MODES} 중 하나여야 합니다")
+# full 모드 장애물 통계 계산 위치
+# network: 네트워크 해상도 텐서에서 바로 통계 계산 (원본 크기 업샘플 및 numpy 복사 생략)
+# upsample: 원본 해상도 깊이 맵으로 계산 (기존 방식)
+DEPTH_STATS_MODE = os.getenv("DEPTH_STATS_MODE", "network")
+# 시작 시 워밍업: 예상 프레임 크기(가로x세로)와 추론 해상도로 더미 프레임을 미리 추론해
+# 첫 요청이 커널 선택, 메모리 할당, 위치 임베딩 보간 비용을 치르지 않도록 함
+DEPTH_WARMUP = os.getenv("DEPTH_WARMUP", "1") == "1"
+DEPTH_WARMUP_FRAMES = [tuple(int(v) for v in reversed(shape.split("x"))) for shape in os.getenv("DEPTH_WARMUP_FRAMES", "720x1280").split(",")]
+DEPTH_WARMUP_SIZES = tuple(int(size) for size in os.getenv("DEPTH_WARMUP_SIZES", str(DEPTH_INPUT_SIZE)).split(","))
+DEPTH_WARMUP_ITERATIONS = int(os.getenv("DEPTH_WARMUP_ITERATIONS", "3"))
+# PyTorch 2.x torch.compile (DEPTH_COMPILE=1, 그래프는 워밍업 중 입력 크기별로 생성)
+DEPTH_COMPILE = os.getenv("DEPTH_COMPILE", "0") == "1"
+
+# --- 깊이 모델 레지스트리 ---
+# 체크포인트는 처음 사용할 때 로드하고, 상주 메모리가 예산을 넘으면 가장 오래 안 쓴 모델부터 해제
+DEPTH_MODEL_SPECS = {
+    'small': {'config': {'encoder': 'vits', 'features': 64, 'out_channels': [48, 96, 192, 384]},
+              'checkpoint': 'depth_anything_v2_metric_hypersim_vits.pth', 'max_depth': 20},
+    'base': {'config': {'encoder': 'vitb', 'features': 128, 'out_channels': [96, 192, 384, 768]},
+             'checkpoint': 'depth_anything_v2_metric_hypersim_vitb.pth', 'max_depth': 20},
+    'large': {'config': {'encoder': 'vitl', 'features': 256, 'out_channels': [256, 512, 1024, 1024]},
+              'checkpoint': 'depth_anything_v2_metric_hypersim_vitl.pth', 'max_depth': 20},
+}
+DEPTH_DEFAULT_MODEL = os.getenv("DEPTH_MODEL", "small")
+if DEPTH_DEFAULT_MODEL not in DEPTH_MODEL_SPECS:
+    raise ValueError(f"DEPTH_MODEL은 {list(DEPTH_MODEL_SPECS)} 중 하나여야 합니다")
+DEPTH_MODEL_MEMORY_BUDGET_MB = float(os.getenv("DEPTH_MODEL_MEMORY_BUDGET_MB", "0"))  # 0이면 제한 없음
+# 시작 시 미리 로드할 모델 (쉼표 구분, 기본 모델은 항상 포함)
+# thread 모드: 목록에 없는 모델은 요청 스레드에서 로드하므로 다른 클라이언트의 배치 추론을 막지 않음
+# process 모드: 워커가 목록의 모델만 가지고 있으므로 그 외 모델 요청은 400으로 거절
+DEPTH_PRELOAD_MODELS = list(dict.fromkeys([DEPTH_DEFAULT_MODEL] + [name.strip() for name in os.getenv("DEPTH_PRELOAD_MODELS", "").split(",") if name.strip()]))
+if any(name not in DEPTH_MODEL_SPECS for name in DEPTH_PRELOAD_MODELS):
+    raise ValueError(f"DEPTH_PRELOAD_MODELS는 {list(DEPTH_MODEL_SPECS)} 중에서 골라야 합니다")
+
+def depth_checkpoint_path(model_name):
     # 모델 가중치 파일 경로를 'a-eye' 디렉토리 기준으로 수정
-    checkpoint_path = os.path.join(os.path.dirname(__file__), 'checkpoints', 'depth_anything_v2_metric_hypersim_vits.pth')
-    depth_model.load_state_dict(torch.load(checkpoint_path, map_location=DEVICE))
-    depth_model = depth_model.to(DEVICE).eval()
+    return os.path.join(os.path.dirname(__file__), 'checkpoints', DEPTH_MODEL_SPECS[model_name]['checkpoint'])
+
+def load_depth_model(model_name):
+    spec = DEPTH_MODEL_SPECS[model_name]
+    # 체크포인트를 mmap으로 읽고 랜덤 초기화 없이 가중치를 바로 연결 (워커 간 페이지 캐시 공유)
+    model = load_depth_checkpoint(spec['config'], depth_checkpoint_path(model_name), spec['max_depth'],
+                                  DEVICE, DEPTH_QUANTIZE, DEPTH_COMPILE)
+    if DEPTH_QUANTIZE == 'int8' and DEVICE == 'cpu':
+        logger.info(f"Depth model '{model_name}' quantized to dynamic int8 (nn.Linear layers)")
     logger.info(f"Depth Anything V2 '{model_name}' (Hypersim) model loaded on {DEVICE}")
-except FileNotFoundError:
-    logger.error(f"Checkpoint file not found. Make sure a valid checkpoint file exists in 'checkpoints/'.")
-    depth_model = None # 모델 로드 실패 시 None으로 설정
-except Exception as e:
-    logger.error(f"Error loading depth model: {e}", exc_info=True)
-    depth_model = None
-
-def analyze_depth_for_obstacles(image_pil):
+    return model
+
+depth_registry = None  # 워밍업 단계에서 생성
+depth_state = {
+    "status": "pending",  # pending -> loading -> ready | failed
+    "stage": None,
+    "progress": 0.0,
+    "error": None,
+    "started_at": None,
+    "ready_at": None,
+    "warmup": None
+}
+
+def get_depth_model(model_name=DEPTH_DEFAULT_MODEL):
+    """레지스트리에서 깊이 모델을 가져옵니다 (필요 시 로드). 로드 실패 시 None."""
+    if depth_registry is None:
+        return None
+    try:
+        return depth_registry.get(model_name)
+    except FileNotFoundError:
+        logger.error(f"Checkpoint file not found. Make sure a valid checkpoint file exists in 'checkpoints/'.")
+    except Exception as e:
+        logger.error(f"Error loading depth model: {e}", exc_info=True)
+    return None
+
+def depth_warmup_plan():
+    """실제 요청 경로와 같은 DepthAnythingV2.warmup 인자 목록 (frame_shapes, input_sizes, iterations, threshold)."""
+    # full 모드 + network 통계 모드는 infer_batch_stats, 그 외에는 깊이 맵 경로 사용
+    threshold = OBSTACLE_THRESHOLD_M if DEPTH_STATS_MODE == 'network' and DEPTH_ROI_MODE == 'full' else None
+    plan = [(DEPTH_WARMUP_FRAMES, DEPTH_WARMUP_SIZES, DEPTH_WARMUP_ITERATIONS, threshold)]
+    
+    if DEPTH_ROI_MODE == 'corridor':
+        # 중앙 통로 크롭과 전체 프레임을 절반 해상도로 추론
+        crop_shapes = [center_region(np.empty((h, w), dtype=np.uint8)).shape for h, w in DEPTH_WARMUP_FRAMES]
+        roi_sizes = sorted({corridor_input_size(size) for size in DEPTH_WARMUP_SIZES})
+        plan.append((DEPTH_WARMUP_FRAMES + crop_shapes, roi_sizes, DEPTH_WARMUP_ITERATIONS, None))
+    return plan
+
+def log_warmup_reports(reports):
+    for report in reports:
+        logger.info(f"🔥 깊이 모델 워밍업 {report['frame_shape']} @ {report['input_size']}: "
+                    f"cold {report['cold_ms']}ms -> warm {report['warm_ms']}ms (max {report['warm_max_ms']}ms)")
+
+def warm_up_depth_model(model):
+    """설정된 프레임 크기와 해상도로 실제 요청 경로를 미리 실행하고 cold/warm 지연시간 리포트를 반환합니다."""
+    reports = [report for args in depth_warmup_plan() for report in model.warmup(*args)]
+    log_warmup_reports(reports)
+    return reports
+
+def start_depth_workers():
+    """process 모드: 워커 프로세스를 띄우고 (각자 모델 로드·워밍업) 첫 워커의 워밍업 리포트를 반환합니다."""
+    reports = depth_batcher.start({
+        "device": DEVICE,
+        "threads": inference_threads_per_worker(),
+        "quantize": DEPTH_QUANTIZE,
+        "compile": DEPTH_COMPILE,
+        "default_model": DEPTH_DEFAULT_MODEL,
+        "preload_models": DEPTH_PRELOAD_MODELS,
+        "memory_budget_bytes": int(DEPTH_MODEL_MEMORY_BUDGET_MB * 2**20),
+        "warmup": depth_warmup_plan() if DEPTH_WARMUP else None
+    })
+    if not reports[0]:
+        return None
+    reports = [report for plan_reports in reports[0] for report in plan_reports]
+    log_warmup_reports(reports)
+    return reports
+
+def initialize_depth_runtime():
+    """torch import, 디바이스 선택, 기본 모델 로드를 수행하고 진행 상황을 depth_state에 기록합니다."""
+    global DEVICE, depth_registry
+    
+    depth_state.update(status="loading", stage="import", progress=0.1, error=None, started_at=time.time())
+    try:
+        import torch
+        from depth_anything_v2.registry import ModelRegistry
+        
+        DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
+        configure_inference_threads()
+        depth_registry = ModelRegistry(load_depth_model, int(DEPTH_MODEL_MEMORY_BUDGET_MB * 2**20))
+        
+        if DEPTH_EXECUTOR == 'process':
+            # 모델은 각 워커 프로세스가 로드 (이 프로세스는 프레임 전달만 담당)
+            depth_state.update(stage="start_workers", progress=0.4)
+            depth_state["warmup"] = start_depth_workers()
+        else:
+            # 기본 모델과 DEPTH_PRELOAD_MODELS는 시작 시 미리 로드
+            depth_state.update(stage="load_model", progress=0.4)
+            for model_name in DEPTH_PRELOAD_MODELS:
+                if get_depth_model(model_name) is None:
+                    raise RuntimeError(f"깊이 모델 '{model_name}' 로드 실패")
+            
+            if DEPTH_WARMUP:
+                depth_state.update(stage="warmup", progress=0.7)
+                depth_state["warmup"] = warm_up_depth_model(get_depth_model())
+        
+        depth_state.update(status="ready", stage="ready", progress=1.0, ready_at=time.time())
+        logger.info(f"✅ 깊이 모델 준비 완료 ({depth_state['ready_at'] - depth_state['started_at']:.1f}초)")
+    except Exception as e:
+        logger.error(f"깊이 모델 초기화 실패: {e}", exc_info=True)
+        depth_state.update(status="failed", error=str(e))
+
+def check_depth_workers():
+    """process 모드에서 모든 워커가 재시작 한도를 넘었으면 깊이 런타임을 실패 상태로 바꿉니다."""
+    failed = getattr(depth_batcher, 'failed', None)
+    if failed and depth_state["status"] == "ready":
+        depth_state.update(status="failed", stage="workers", error=failed)
+
+def depth_not_ready_response():
+    """깊이 모델이 준비되지 않았으면 즉시 반환할 응답을, 준비되었으면 None을 반환합니다."""
+    check_depth_workers()
+    if depth_state["status"] == "ready":
+        return None
+    if depth_state["status"] == "failed":
+        return jsonify({"error": "Depth model is not available.", "status": "failed"}), 503
+    return jsonify({
+        "status": "warming",
+        "message": "깊이 모델을 준비 중입니다. 잠시 후 다시 시도해주세요.",
+        "stage": depth_state["stage"],
+        "progress": depth_state["progress"]
+    }), 503
+
+# --- 깊이 추론 워커 풀 + 마이크로 배칭 ---
+# Flask 요청 스레드는 프레임을 큐에 넣고 결과만 기다리며, 추론은 고정된 수의 워커 스레드가 수행
+# 워커는 동시에 들어온 /analyze_depth 프레임을 몇 ms 동안 모아 한 번의 forward로 처리
+DEPTH_BATCH_MAX_SIZE = int(os.getenv("DEPTH_BATCH_MAX_SIZE", "8"))
+DEPTH_BATCH_WAIT_MS = float(os.getenv("DEPTH_BATCH_WAIT_MS", "5"))
+DEPTH_WORKERS = int(os.getenv("DEPTH_WORKERS", "1"))
+# 큐에 대기 가능한 최대 프레임 수 (초과 시 503으로 즉시 거절)
+DEPTH_QUEUE_SIZE = int(os.getenv("DEPTH_QUEUE_SIZE", "32"))
+# 워커당 intra-op 스레드 수 (0이면 CPU 코어 수 / 워커 수)
+DEPTH_THREADS_PER_WORKER = int(os.getenv("DEPTH_THREADS_PER_WORKER", "0"))
+# thread: 한 프로세스 안의 워커 스레드들이 모델 하나를 공유
+# process: DEPTH_WORKERS개의 워커 프로세스가 mmap 가중치를 공유하고 프레임은 공유 메모리로 전달 (GIL 우회)
+DEPTH_EXECUTOR = os.getenv("DEPTH_EXECUTOR", "thread")
+if DEPTH_EXECUTOR not in ('thread', 'process'):
+    raise ValueError("DEPTH_EXECUTOR는 'thread' 또는 'process'여야 합니다")
+# process 모드 공유 메모리 슬롯 하나에 담을 수 있는 최대 프레임 크기 (가로x세로, 초과 프레임은 큐로 직접 전달)
+# 슬롯은 프레임 픽셀당 7바이트이며 /dev/shm 여유 공간의 절반까지만 만듦 (Docker 기본 64 MiB면 --shm-size로 늘릴 것)
+DEPTH_PROCESS_MAX_FRAME = os.getenv("DEPTH_PROCESS_MAX_FRAME", "1920x1080")
+# process 모드에서 결과를 기다리는 최대 시간 (초과 시 504), 두 배를 넘도록 끝나지 않는 워커는 강제 종료
+DEPTH_JOB_TIMEOUT_S = float(os.getenv("DEPTH_JOB_TIMEOUT_S", "10"))
+# 워커가 연속으로 이 횟수보다 많이 죽으면 (초기화 실패 등) 더 이상 재시작하지 않고 /ready를 실패로 표시
+DEPTH_WORKER_MAX_RESTARTS = int(os.getenv("DEPTH_WORKER_MAX_RESTARTS", "5"))
+
+def inference_threads_per_worker():
+    """동시에 도는 워커들의 forward가 CPU 코어를 나눠 쓰도록 워커당 torch intra-op 스레드 수를 정합니다."""
+    return DEPTH_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // max(1, DEPTH_WORKERS))
+
+def configure_inference_threads():
+    import torch
+    
+    if DEVICE != 'cpu' or DEPTH_EXECUTOR == 'process':
+        return
+    threads = inference_threads_per_worker()
+    torch.set_num_threads(threads)
+    logger.info(f"깊이 추론 워커 {DEPTH_WORKERS}개, 워커당 스레드 {threads}개")
+
+class DepthBatcher:
+    def __init__(self, max_batch_size, max_wait_ms, num_workers=1, max_queue_size=0):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.num_workers = max(1, num_workers)
+        self._queue = queue.Queue(maxsize=max(0, max_queue_size))
+        self._threads = []
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"batches": 0, "frames": 0, "largest_batch": 0, "rejected": 0}
+
+    def submit(self, frame, input_size=DEPTH_INPUT_SIZE, threshold=None, model_name=DEPTH_DEFAULT_MODEL):
+        """
+        RGB 프레임을 배치 큐에 넣고 결과 Future를 반환합니다.
+        threshold가 없으면 원본 크기 깊이 맵, 있으면 네트워크 해상도 통계(infer_stats)를 돌려줍니다.
+        모델은 호출한 스레드에서 가져오므로 (필요 시 로드) 체크포인트 로드가 배치 워커를 막지 않습니다.
+        """
+        depth_model = get_depth_model(model_name)
+        if depth_model is None:
+            raise RuntimeError(f"깊이 모델 '{model_name}'을 로드할 수 없습니다")
+        
+        self._ensure_workers()
+        future = Future()
+        try:
+            self._queue.put_nowait((frame, model_name, input_size, threshold, future, depth_model))
+        except queue.Full:
+            with self._stats_lock:
+                self.stats["rejected"] += 1
+            raise DepthQueueFull(f"깊이 추론 큐가 가득 찼습니다 ({self._queue.maxsize}프레임)")
+        return future
+
+    def wait(self, future):
+        return future.result()
+
+    def infer(self, frame, input_size=DEPTH_INPUT_SIZE, model_name=DEPTH_DEFAULT_MODEL):
+        return self.submit(frame, input_size, model_name=model_name).result()
+
+    def infer_stats(self, frame, threshold, input_size=DEPTH_INPUT_SIZE, model_name=DEPTH_DEFAULT_MODEL):
+        return self.submit(frame, input_size, threshold, model_name).result()
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queued"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        stats["workers"] = sum(thread.is_alive() for thread in self._threads)
+        stats["avg_batch"] = round(stats["frames"] / stats["batches"], 2) if stats["batches"] else 0
+        return stats
+
+    def _ensure_workers(self):
+        with self._thread_lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while len(self._threads) < self.num_workers:
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            
+            # 첫 프레임 도착 후 max_wait 동안 추가 프레임 수집
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        # 모델, 추론 해상도, 결과 종류(깊이 맵/통계)가 같은 프레임끼리만 함께 forward
+        # submit에서 가져온 모델 객체를 그대로 사용 (배치 루프 안에서는 로드하지 않음)
+        models = {job[1]: job[5] for job in batch}
+        outcomes = run_depth_jobs(models.get, [job[:4] for job in batch])
+        for (_, _, _, _, future, _), (result, error) in zip(batch, outcomes):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        
+        with self._stats_lock:
+            self.stats["batches"] += 1
+            self.stats["frames"] += len(batch)
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        
+        if len(batch) > 1:
+            logger.info(f"📦 깊이 배치 추론 완료 - 프레임 {len(batch)}개")
+
+if DEPTH_EXECUTOR == 'process':
+    # 워커 프로세스는 initialize_depth_runtime에서 시작
+    _max_frame_w, _max_frame_h = (int(v) for v in DEPTH_PROCESS_MAX_FRAME.split("x"))
+    depth_batcher = DepthProcessPool(
+        {name: dict(spec, checkpoint_path=depth_checkpoint_path(name)) for name, spec in DEPTH_MODEL_SPECS.items()},
+        DEPTH_WORKERS, DEPTH_BATCH_MAX_SIZE, DEPTH_BATCH_WAIT_MS, DEPTH_QUEUE_SIZE, _max_frame_w * _max_frame_h,
+        DEPTH_JOB_TIMEOUT_S, DEPTH_WORKER_MAX_RESTARTS
+    )
+else:
+    depth_batcher = DepthBatcher(DEPTH_BATCH_MAX_SIZE, DEPTH_BATCH_WAIT_MS, DEPTH_WORKERS, DEPTH_QUEUE_SIZE)
+
+# --- 시간적 깊이 재사용 (프레임 변화 게이트) ---
+# 직전에 실제로 추론한 프레임과 거의 같으면 캐시된 깊이 통계를 반환
+# 천천히 다가오는 물체도 누적 변화로 감지되도록 마지막 "추론" 프레임과 비교하고,
+# 안전을 위해 TTL과 연속 재사용 횟수를 제한
+DEPTH_GATE_ENABLED = os.getenv("DEPTH_GATE_ENABLED", "1") == "1"
+DEPTH_GATE_THRESHOLD = float(os.getenv("DEPTH_GATE_THRESHOLD", "3.0"))  # 32x32 흑백 평균 절대 차이 (0~255)
+DEPTH_GATE_TTL_S = float(os.getenv("DEPTH_GATE_TTL_S", "1.0"))
+DEPTH_GATE_MAX_REUSE = int(os.getenv("DEPTH_GATE_MAX_REUSE", "5"))
+DEPTH_GATE_MAX_CLIENTS = 256
+DEPTH_GATE_SIGNATURE_SIZE = (32, 32)
+
+class DepthFrameGate:
+    def __init__(self, threshold, ttl_s, max_reuse, max_clients):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_reuse = max_reuse
+        self.max_clients = max_clients
+        self._entries = OrderedDict()  # client_key -> 마지막 추론 결과
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "inference_time_total": 0.0}
+
+    @staticmethod
+    def signature(image_pil):
+        """축소한 흑백 이미지를 프레임 변화 비교용 서명으로 사용합니다."""
+        small = image_pil.resize(DEPTH_GATE_SIGNATURE_SIZE, Image.BOX).convert("L")
+        return np.asarray(small, dtype=np.float32)
+
+    def lookup(self, client_key, signature, params):
+        """변화가 임계값 이하이고 캐시가 유효하면 캐시된 통계를, 아니면 None을 반환합니다."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(client_key)
+            if entry is None or entry["params"] != params:
+                self.stats["misses"] += 1
+                return None
+            
+            if now - entry["timestamp"] > self.ttl_s or entry["reuse_count"] >= self.max_reuse:
+                self.stats["stale"] += 1
+                return None
+            
+            if float(np.mean(np.abs(signature - entry["signature"]))) > self.threshold:
+                self.stats["misses"] += 1
+                return None
+            
+            entry["reuse_count"] += 1
+            self._entries.move_to_end(client_key)
+            self.stats["hits"] += 1
+            return entry["stats"]
+
+    def store(self, client_key, signature, params, stats, inference_time):
+        with self._lock:
+            self._entries[client_key] = {
+                "signature": signature,
+                "params": params,
+                "stats": stats,
+                "timestamp": time.time(),
+                "reuse_count": 0
+            }
+            self._entries.move_to_end(client_key)
+            while len(self._entries) > self.max_clients:
+                self._entries.popitem(last=False)
+            self.stats["inference_time_total"] += inference_time
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            clients = len(self._entries)
+        
+        inferences = stats["misses"] + stats["stale"]
+        lookups = stats["hits"] + inferences
+        avg_inference_time = stats.pop("inference_time_total") / inferences if inferences else 0.0
+        stats.update({
+            "enabled": DEPTH_GATE_ENABLED,
+            "clients": clients,
+            "hit_rate": round(stats["hits"] / lookups, 3) if lookups else 0.0,
+            "avg_inference_time": round(avg_inference_time, 3),
+            "saved_model_time": round(stats["hits"] * avg_inference_time, 3)
+        })
+        return stats
+
+depth_gate = DepthFrameGate(DEPTH_GATE_THRESHOLD, DEPTH_GATE_TTL_S, DEPTH_GATE_MAX_REUSE, DEPTH_GATE_MAX_CLIENTS)
+
+def analyze_depth_for_obstacles(image_pil, input_size=DEPTH_INPUT_SIZE, roi_mode=DEPTH_ROI_MODE, model_name=DEPTH_DEFAULT_MODEL):
     """
     이미지에서 50cm 이내의 장애물을 감지합니다.
     calibrationFactor가 설정되어 있어야 합니다.
     """
     try:
-        # 이미지를 OpenCV 형식으로 변환
-        cv_image = np.array(image_pil)
-        cv_image = cv_image[:, :, ::-1].copy()  # RGB -> BGR
+        # PIL RGB 배열을 그대로 전달 (BGR 변환 없이 모델에서 채널 순서 처리)
+        rgb_image = np.asarray(image_pil)
+        
+        if roi_mode == 'corridor':
+            # 중앙 통로 크롭과 전체 프레임을 같은 절반 해상도로 제출 (같은 배치로 한 번에 추론됨)
+            roi_size = corridor_input_size(input_size)
+            corridor_future = depth_batcher.submit(center_region(rgb_image), roi_size, model_name=model_name)
+            periphery_future = depth_batcher.submit(rgb_image, roi_size, model_name=model_name)
+            return compose_corridor_depth(depth_batcher.wait(periphery_future), depth_batcher.wait(corridor_future))
         
-        # 깊이 추정
-        depth_map = depth_model.infer_image(cv_image)
+        # 깊이 추정 (동시 요청과 함께 배치 처리)
+        depth_map = depth_batcher.infer(rgb_image, input_size, model_name)
         
         return depth_map
         
+    except (DepthQueueFull, DepthTimeout):
+        raise
     except Exception as e:
         logger.error(f"깊이 분석 오류: {e}")
         return None
 
+def analyze_depth_stats(image_pil, threshold, input_size=DEPTH_INPUT_SIZE, model_name=DEPTH_DEFAULT_MODEL):
+    """
+    원본 크기로 업샘플하지 않고 네트워크 해상도 깊이에서 최소거리/중앙 최소거리/임계값 미만 비율만 계산합니다.
+    """
+    try:
+        rgb_image = np.asarray(image_pil)
+        return depth_batcher.infer_stats(rgb_image, threshold, input_size, model_name)
+    except (DepthQueueFull, DepthTimeout):
+        raise
+    except Exception as e:
+        logger.error(f"깊이 통계 분석 오류: {e}")
+        return None
+
+def depth_busy_response():
+    """추론 큐가 가득 찼을 때 클라이언트가 잠시 후 재시도하도록 503을 반환합니다."""
+    response = jsonify({"error": "깊이 추론 요청이 많아 처리할 수 없습니다. 잠시 후 다시 시도해주세요.", "status": "busy"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+def depth_timeout_response():
+    """워커가 제한 시간 안에 결과를 내지 못했을 때 504를 반환합니다."""
+    response = jsonify({"error": "깊이 추론 시간이 초과되었습니다. 잠시 후 다시 시도해주세요.", "status": "timeout"})
+    response.headers["Retry-After"] = "1"
+    return response, 504
+
+def parse_input_size(value):
+    """요청의 inputSize 값을 검증합니다. 값이 없으면 서버 기본값, 허용되지 않은 값이면 None."""
+    if value in (None, ''):
+        return DEPTH_INPUT_SIZE
+    try:
+        input_size = int(value)
+    except ValueError:
+        return None
+    return input_size if input_size in DEPTH_INPUT_SIZES else None
+
+# 깊이 런타임 초기화 (워커 풀 설정 등 위의 정의가 모두 끝난 뒤 시작)
+# process 모드 워커는 이 파일을 다시 import하지 않고 depth_workers만 불러옴
+if DEPTH_STARTUP_MODE == 'blocking':
+    initialize_depth_runtime()
+else:
+    threading.Thread(target=initialize_depth_runtime, daemon=True).start()
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    check_depth_workers()
+    state = dict(depth_state)
+    return jsonify(state), 200 if state["status"] == "ready" else 503
+
 @app.route('/calibrate', methods=['POST'])
 def calibrate():
-    if DEVICE == 'cpu':
-        return jsonify({"error": "GPU 환경에서만 사용이 가능합니다"}), 400
-        
-    if not depth_model:
+    not_ready = depth_not_ready_response()
+    if not_ready:
+        return not_ready
+    
+    # CPU에서는 int8 양자화 모드에서만 보정 허용
+    if DEVICE == 'cpu' and DEPTH_QUANTIZE != 'int8':
+        return jsonify({"error": "GPU 환경 또는 DEPTH_QUANTIZE=int8 모드에서만 사용이 가능합니다"}), 400
+        
+    model_name = request.form.get('depthModel') or DEPTH_DEFAULT_MODEL
+    if model_name not in DEPTH_MODEL_SPECS:
+        return jsonify({"error": f"depthModel must be one of {list(DEPTH_MODEL_SPECS)}"}), 400
+    if DEPTH_EXECUTOR == 'process' and model_name not in DEPTH_PRELOAD_MODELS:
+        return jsonify({"error": f"depthModel must be one of {DEPTH_PRELOAD_MODELS} in process mode"}), 400
+    
+    # process 모드에서는 워커 프로세스가 모델을 가지고 있음
+    if DEPTH_EXECUTOR == 'thread' and not get_depth_model(model_name):
         logger.error("Calibration failed because depth model is not loaded.")
         return jsonify({"error": "Depth model is not available."}), 500
 
@@ -1115,6 +2328,10 @@ def calibrate():
     if not user_height_cm > 0:
         return jsonify({"error": "Invalid height provided"}), 400
 
+    input_size = parse_input_size(request.form.get('inputSize'))
+    if input_size is None:
+        return jsonify({"error": f"inputSize must be one of {list(DEPTH_INPUT_SIZES)}"}), 400
+
     try:
         # 사용자 키(cm)를 기반으로 팔 길이(m) 추정
         # 팔 길이 = (키 * 0.26) / 100 (실제 측정 기반: 175cm → 45cm)
@@ -1122,12 +2339,11 @@ def calibrate():
         
         image_pil = Image.open(file.stream).convert("RGB")
         
-        # 이미지를 OpenCV 형식으로 변환 (예제 코드와 동일하게)
-        cv_image = np.array(image_pil)
-        cv_image = cv_image[:, :, ::-1].copy()  # RGB -> BGR
+        # PIL RGB 배열을 그대로 전달 (BGR 변환 없이 모델에서 채널 순서 처리)
+        rgb_image = np.asarray(image_pil)
         
-        # infer_image 메소드 사용 (예제 코드 방식)
-        depth_map = depth_model.infer_image(cv_image)
+        # 추론 워커 풀에서 깊이 추정
+        depth_map = depth_batcher.infer(rgb_image, input_size, model_name)
         
         # 화면 중앙점의 거리를 측정값으로 사용 (예제 코드와 동일)
         h, w = depth_map.shape
@@ -1143,55 +2359,114 @@ def calibrate():
         
         return jsonify({"calibrationFactor": calibration_factor})
 
+    except DepthQueueFull as e:
+        logger.warning(f"Calibration rejected: {e}")
+        return depth_busy_response()
+    except DepthTimeout as e:
+        logger.error(f"Calibration timed out: {e}")
+        return depth_timeout_response()
     except Exception as e:
         logger.error(f"Calibration failed: {e}", exc_info=True)
         return jsonify({"error": "An error occurred during calibration."}), 500
 
+@app.route('/get_depth_status', methods=['GET'])
+def get_depth_status():
+    if depth_registry is None:
+        return jsonify({"model_loaded": False, "startup": dict(depth_state)})
+    
+    pos_embed_cache = {}
+    for model_name in DEPTH_MODEL_SPECS:
+        model = depth_registry.peek(model_name)
+        if model is not None:
+            pos_embed_cache[model_name] = model.pretrained.pos_embed_cache_info()
+    
+    return jsonify({
+        "model_loaded": depth_registry.peek(DEPTH_DEFAULT_MODEL) is not None or (DEPTH_EXECUTOR == 'process' and depth_state["status"] == "ready"),
+        "startup": dict(depth_state),
+        "default_model": DEPTH_DEFAULT_MODEL,
+        "models": depth_registry.info(),
+        "device": DEVICE,
+        "quantization": DEPTH_QUANTIZE if DEVICE == 'cpu' and DEPTH_QUANTIZE else None,
+        "input_size": DEPTH_INPUT_SIZE,
+        "input_sizes": list(DEPTH_INPUT_SIZES),
+        "roi_mode": DEPTH_ROI_MODE,
+        "stats_mode": DEPTH_STATS_MODE,
+        "executor": DEPTH_EXECUTOR,
+        "batching": depth_batcher.get_stats(),
+        "frame_gate": depth_gate.get_stats(),
+        "pos_embed_cache": pos_embed_cache
+    })
+
 @app.route('/analyze_depth', methods=['POST'])
 def analyze_depth():
     """
     이미지의 깊이를 분석하고 50cm 이내 장애물을 감지합니다.
     """
+    not_ready = depth_not_ready_response()
+    if not_ready:
+        return not_ready
+    
     try:
         # 보정 계수 받기
         calibration_factor = float(request.form.get('calibrationFactor', 1.0))
         
+        # 추론 해상도 (252/364/518 등, 미지정 시 서버 기본값)
+        input_size = parse_input_size(request.form.get('inputSize'))
+        if input_size is None:
+            return jsonify({"error": f"inputSize는 {list(DEPTH_INPUT_SIZES)} 중 하나여야 합니다"}), 400
+        
+        roi_mode = request.form.get('roiMode') or DEPTH_ROI_MODE
+        if roi_mode not in DEPTH_ROI_MODES:
+            return jsonify({"error": f"roiMode는 {list(DEPTH_ROI_MODES)} 중 하나여야 합니다"}), 400
+        
+        model_name = request.form.get('depthModel') or DEPTH_DEFAULT_MODEL
+        if model_name not in DEPTH_MODEL_SPECS:
+            return jsonify({"error": f"depthModel은 {list(DEPTH_MODEL_SPECS)} 중 하나여야 합니다"}), 400
+        if DEPTH_EXECUTOR == 'process' and model_name not in DEPTH_PRELOAD_MODELS:
+            return jsonify({"error": f"process 모드에서는 depthModel {DEPTH_PRELOAD_MODELS}만 사용할 수 있습니다"}), 400
+        
         if 'image' not in request.files:
             return jsonify({"error": "이미지 파일이 없습니다"}), 400
             
         file = request.files['image']
         image_pil = Image.open(file.stream).convert("RGB")
         
-        # 깊이 분석
-        depth_map = analyze_depth_for_obstacles(image_pil)
-        if depth_map is None:
-            return jsonify({"error": "깊이 분석 실패"}), 500
-            
-        # 보정 계수 적용
-        depth_map_calibrated = depth_map * calibration_factor
-        
-        # 50cm(0.5m) 이내 장애물 검사
-        obstacle_threshold = 0.5  # 50cm
-        close_obstacles = depth_map_calibrated < obstacle_threshold
-        
-        # 장애물이 있는 픽셀의 비율 계산
-        total_pixels = depth_map_calibrated.size
-        obstacle_pixels = np.sum(close_obstacles)
-        obstacle_ratio = obstacle_pixels / total_pixels
-        
-        # 중앙 영역에서 가장 가까운 거리 확인
-        h, w = depth_map_calibrated.shape
-        center_h, center_w = h // 4, w // 4  # 중앙 1/4 영역
-        center_region = depth_map_calibrated[center_h:3*center_h, center_w:3*center_w]
-        min_distance = float(np.min(center_region))
-        
-        # 경고 조건: 중앙 영역에 50cm 이내 물체가 있거나, 전체 화면의 10% 이상이 장애물인 경우
-        should_warn = min_distance < obstacle_threshold or obstacle_ratio > 0.1
-        
-        # 전체 화면의 최소 거리도 계산
-        global_min_distance = float(np.min(depth_map_calibrated))
-        
-        if should_warn:
+        # 장면이 거의 변하지 않았으면 캐시된 통계 재사용
+        client_key = get_client_id()
+        params = (calibration_factor, input_size, roi_mode, model_name)
+        stats = None
+        if DEPTH_GATE_ENABLED:
+            signature = depth_gate.signature(image_pil)
+            stats = depth_gate.lookup(client_key, signature, params)
+        cached = stats is not None
+        
+        if not cached:
+            inference_start = time.time()
+            if roi_mode == 'full' and DEPTH_STATS_MODE == 'network' and calibration_factor > 0:
+                # 네트워크 해상도에서 바로 통계 계산 (보정 계수만큼 임계값을 나눠서 비교)
+                stats = analyze_depth_stats(image_pil, OBSTACLE_THRESHOLD_M / calibration_factor, input_size, model_name)
+                if stats is None:
+                    return jsonify({"error": "깊이 분석 실패"}), 500
+                stats = summarize_depth_stats(stats, calibration_factor)
+            else:
+                # 깊이 분석
+                depth_map = analyze_depth_for_obstacles(image_pil, input_size, roi_mode, model_name)
+                if depth_map is None:
+                    return jsonify({"error": "깊이 분석 실패"}), 500
+                
+                # 50cm(0.5m) 이내 장애물 검사
+                stats = summarize_depth(depth_map, calibration_factor)
+            if DEPTH_GATE_ENABLED:
+                depth_gate.store(client_key, signature, params, stats, time.time() - inference_start)
+        
+        should_warn = stats["should_warn"]
+        min_distance = stats["min_distance"]
+        global_min_distance = stats["global_min_distance"]
+        obstacle_ratio = stats["obstacle_ratio"]
+        
+        if cached:
+            logger.info(f"♻️ 장면 변화 없음 - 캐시된 깊이 통계 재사용 (중앙 최소거리: {min_distance:.2f}m)")
+        elif should_warn:
             logger.warning(f"🚨 장애물 감지! 중앙 최소거리: {min_distance:.2f}m, 전체 최소거리: {global_min_distance:.2f}m, 장애물비율: {obstacle_ratio:.1%}")
         else:
             logger.info(f"✅ 안전 - 중앙 최소거리: {min_distance:.2f}m, 전체 최소거리: {global_min_distance:.2f}m, 장애물비율: {obstacle_ratio:.1%}")
@@ -1200,9 +2475,19 @@ def analyze_depth():
             "should_warn": bool(should_warn),
             "min_distance": round(float(min_distance), 2),
             "obstacle_ratio": round(float(obstacle_ratio), 3),
+            "input_size": input_size,
+            "roi_mode": roi_mode,
+            "depth_model": model_name,
+            "cached": cached,
             "message": f"가장 가까운 물체: {min_distance:.2f}m" + (" - 경고!" if should_warn else "")
         })
         
+    except DepthQueueFull as e:
+        logger.warning(f"⏳ {e}")
+        return depth_busy_response()
+    except DepthTimeout as e:
+        logger.error(f"⏰ {e}")
+        return depth_timeout_response()
     except Exception as e:
         logger.error(f"❌ 깊이 분석 중 오류 발생: {e}", exc_info=True)
         return jsonify({"error": "깊이 분석 중 서버에서 오류가 발생했습니다."}), 500
@@ -25,6 +25,10 @@ document.addEventListener("DOMContentLoaded", () => {
   let navigationQueue = [];
   let navigationSession = null;
   let watchId = null;
+  let responseStream = null;
+  let uploadLoop = null;
+  // 서버가 사용자별 분석 세션을 구분하는 ID (같은 IP를 쓰는 여러 사용자도 분리)
+  const clientId = loadClientId();
 
   settingsButton.addEventListener("click", () => {
     settingsPanel.classList.remove("hidden");
@@ -208,6 +212,17 @@ document.addEventListener("DOMContentLoaded", () => {
     speak(`음성 속도가 ${speed}배로 설정되었습니다.`);
   }
 
+  function loadClientId() {
+    let id = localStorage.getItem("client-id");
+    if (!id) {
+      id = window.crypto?.randomUUID
+        ? window.crypto.randomUUID()
+        : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+      localStorage.setItem("client-id", id);
+    }
+    return id;
+  }
+
   function loadTTSSpeed() {
     const savedSpeed = localStorage.getItem("tts-speed");
     if (savedSpeed) {
@@ -378,6 +393,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
         const response = await fetch(endpoint, {
           method: "POST",
+          headers: { "X-Client-Id": clientId },
           body: formData,
         });
 
@@ -518,6 +534,159 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
+  // --- 응답 스트림 모드 (길안내 중이 아닐 때) ---
+  // 프레임은 /upload_image로 올리기만 하고, 분석 결과는 /stream_responses(SSE)로 도착하는 즉시 읽음
+  // tts_end 모드: 1초마다 최신 프레임 업로드 (읽는 동안 도착한 응답은 서버가 버림)
+  // interval 모드: 설정한 간격마다 업로드
+  const FRAME_UPLOAD_INTERVAL_MS = 1000;
+
+  function startStreamingAnalysis() {
+    responseStream = new EventSource(
+      `/stream_responses?clientId=${encodeURIComponent(clientId)}`
+    );
+    responseStream.addEventListener("description", (event) => {
+      const data = JSON.parse(event.data);
+      logPerformance(
+        `스트림 응답 수신 - API ${data.api_idx}, 서버 처리시간: ${data.processing_time?.toFixed(
+          3
+        )}초`
+      );
+      statusDiv.textContent = data.description;
+      if (data.streamed) {
+        // 문장 단위("partial")로 이미 읽고 있는 응답 - 다시 읽지 않고 끝만 표시
+        endPartialStream(data.request_id);
+        return;
+      }
+      speakAnalysis(data.description);
+    });
+    responseStream.addEventListener("partial", (event) => {
+      speakPartial(JSON.parse(event.data));
+    });
+    responseStream.addEventListener("partial_end", (event) => {
+      // 문장을 보내던 요청이 중간에 실패함 - 더 올 문장이 없음
+      endPartialStream(JSON.parse(event.data).request_id);
+    });
+    responseStream.onerror = () => {
+      logPerformance("응답 스트림 연결 끊김 - 자동 재연결 대기");
+    };
+
+    fetch("/start_auto_processing", {
+      method: "POST",
+      headers: { "X-Client-Id": clientId },
+    })
+      .then((res) => res.json())
+      .then((data) => logPerformance(`서버 시작 응답: ${data.message}`))
+      .catch((err) => logPerformance(`서버 시작 요청 실패: ${err}`));
+
+    runFrameUpload();
+  }
+
+  function stopStreamingAnalysis() {
+    if (responseStream) {
+      responseStream.close();
+      responseStream = null;
+    }
+    clearTimeout(uploadLoop);
+  }
+
+  function runFrameUpload() {
+    if (!isAutoCapturing || !responseStream) return;
+
+    const interval =
+      modeSelect.value === "tts_end"
+        ? FRAME_UPLOAD_INTERVAL_MS
+        : (parseInt(intervalInput.value, 10) || 3) * 1000;
+    uploadFrame().finally(() => {
+      if (isAutoCapturing && responseStream) {
+        uploadLoop = setTimeout(runFrameUpload, interval);
+      }
+    });
+  }
+
+  async function uploadFrame() {
+    const canvas = document.createElement("canvas");
+    canvas.width = video.videoWidth;
+    canvas.height = video.videoHeight;
+    canvas.getContext("2d").drawImage(video, 0, 0, canvas.width, canvas.height);
+    const blob = await new Promise((resolve) =>
+      canvas.toBlob(resolve, "image/jpeg")
+    );
+
+    const formData = new FormData();
+    formData.append("image", blob, "capture.jpg");
+    try {
+      const response = await fetch("/upload_image", {
+        method: "POST",
+        headers: { "X-Client-Id": clientId },
+        body: formData,
+      });
+      if (!response.ok) {
+        logPerformance(`프레임 업로드 실패 - 상태: ${response.status}`);
+      }
+    } catch (err) {
+      logPerformance(`프레임 업로드 오류: ${err}`);
+    }
+  }
+
+  function setTTSStatus(isSpeaking, text = "") {
+    fetch("/set_tts_status", {
+      method: "POST",
+      headers: { "Content-Type": "application/json", "X-Client-Id": clientId },
+      body: JSON.stringify({ is_speaking: isSpeaking, current_text: text }),
+    }).catch((err) => logPerformance(`TTS 상태 전송 실패: ${err}`));
+  }
+
+  // 읽는 동안 서버가 새 응답을 보내지 않도록 TTS 상태를 알림
+  // (앞 응답이 새 응답에 끊겨 늦게 끝난 경우에는 완료를 보내지 않음)
+  let analysisSpeechId = 0;
+  let partialStream = { requestId: null, pending: 0, ended: true };
+
+  function speakAnalysis(text) {
+    const speechId = ++analysisSpeechId;
+    partialStream = { requestId: null, pending: 0, ended: true };
+    setTTSStatus(true, text);
+    speak(text, () => {
+      if (speechId === analysisSpeechId) setTTSStatus(false);
+    });
+  }
+
+  // 스트리밍 중인 응답의 문장을 끊지 않고 이어서 읽음 (새 요청의 첫 문장이 오면 읽던 내용을 멈춤)
+  function speakPartial(data) {
+    if (data.request_id !== partialStream.requestId) {
+      window.speechSynthesis.cancel();
+      analysisSpeechId += 1;
+      partialStream = { requestId: data.request_id, pending: 0, ended: false };
+      statusDiv.textContent = "";
+      setTTSStatus(true, data.text);
+      logPerformance(`부분 응답 읽기 시작 (API ${data.api_idx})`);
+    }
+
+    const stream = partialStream;
+    statusDiv.textContent = `${statusDiv.textContent} ${data.text}`.trim();
+    const utterance = new SpeechSynthesisUtterance(data.text);
+    utterance.lang = "ko-KR";
+    utterance.rate = currentTTSSpeed;
+    utterance.onend = utterance.onerror = () => {
+      stream.pending -= 1;
+      finishPartialSpeech(stream);
+    };
+    stream.pending += 1;
+    window.speechSynthesis.speak(utterance);
+  }
+
+  function endPartialStream(requestId) {
+    if (partialStream.requestId !== requestId) return;
+    partialStream.ended = true;
+    finishPartialSpeech(partialStream);
+  }
+
+  // 마지막 문장까지 읽었고 더 올 문장이 없으면 TTS 완료를 알림
+  function finishPartialSpeech(stream) {
+    if (stream === partialStream && stream.ended && stream.pending <= 0) {
+      setTTSStatus(false);
+    }
+  }
+
   // 시작/정지 토글 버튼
   captureButton.addEventListener("click", () => {
     if (isAutoCapturing) {
@@ -535,9 +704,13 @@ document.addEventListener("DOMContentLoaded", () => {
 
       isAutoCapturing = false;
       clearTimeout(captureLoop);
+      stopStreamingAnalysis();
       window.speechSynthesis.cancel();
 
-      fetch("/stop_auto_processing", { method: "POST" })
+      fetch("/stop_auto_processing", {
+        method: "POST",
+        headers: { "X-Client-Id": clientId },
+      })
         .then((res) => res.json())
         .then((data) =>
           logPerformance(
@@ -589,7 +762,12 @@ document.addEventListener("DOMContentLoaded", () => {
         speak("주변 상황 자동 분석을 시작합니다.");
       }
 
-      runAutoCapture();
+      // 길안내 중에는 위치를 함께 보내는 /navigation_describe 요청-응답 방식 유지
+      if (isNavigating) {
+        runAutoCapture();
+      } else {
+        startStreamingAnalysis();
+      }
     }
   });
 